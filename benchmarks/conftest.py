@@ -0,0 +1,123 @@
+"""
+Fixtures for the benchmarks. Everything runs against the bundled fake
+Mistral server, with the cache and data directories in a temporary
+directory, so no network, API key or existing settings are needed.
+"""
+import os
+import statistics
+import threading
+import time
+import pytest
+
+# Pacing of the fake server: enough to be realistic, short enough to repeat
+LATENCY = 0.02
+TOKENS_PER_SECOND = 2000.0
+REPLY_TOKENS = 60
+
+_results = []
+
+
+@pytest.fixture(scope="session", autouse=True)
+def isolated_paths(tmp_path_factory):
+    """Keeps caches, sessions and indexes out of the user's directories."""
+    base = tmp_path_factory.mktemp("home")
+    saved = {name: os.environ.get(name) for name in ("XDG_CACHE_HOME", "XDG_DATA_HOME")}
+    os.environ["XDG_CACHE_HOME"] = str(base / "cache")
+    os.environ["XDG_DATA_HOME"] = str(base / "data")
+    yield base
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+@pytest.fixture(scope="session")
+def fake_api():
+    """Serves the fake API on a free port and points the client at it."""
+    from desktop4mistral.mistral import fakeserver
+    server = fakeserver.serve(
+        port=0, latency=LATENCY, tokens_per_second=TOKENS_PER_SECOND, reply_tokens=REPLY_TOKENS
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    os.environ["MISTRAL_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1/"
+    os.environ.setdefault("MISTRAL_API_KEY", "fake")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def client(fake_api):
+    from desktop4mistral.mistral.client import Client
+    client = Client()
+    client.listModels()
+    client.setModel("mistral-large-latest")
+    yield client
+    client.python.shutdown()
+
+
+@pytest.fixture(scope="session")
+def subprocess_env():
+    """The environment for child interpreters, able to import this package."""
+    import desktop4mistral
+    package_root = os.path.dirname(os.path.dirname(desktop4mistral.__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_root, env.get("PYTHONPATH")]))
+    return env
+
+
+class SimpleBenchmark:
+    """
+    A small stand-in for pytest-benchmark's fixture, used when it isn't
+    installed. Times the call over a few rounds and reports the results
+    at the end of the run.
+    """
+    ROUNDS = 5
+
+    def __init__(self, name):
+        self.name = name
+        self.extra_info = {}
+        self.timings = []
+
+    def __call__(self, function, *args, **kwargs):
+        return self.pedantic(function, args, kwargs, rounds=self.ROUNDS, warmup_rounds=1)
+
+    def pedantic(self, target, args=(), kwargs=None, setup=None, rounds=1, warmup_rounds=0, iterations=1):
+        kwargs = kwargs or {}
+        result = None
+        for round_number in range(warmup_rounds + rounds):
+            if setup:
+                prepared = setup()
+                if prepared is not None:
+                    args, kwargs = prepared
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = target(*args, **kwargs)
+            if round_number >= warmup_rounds:
+                self.timings.append((time.perf_counter() - start) / iterations)
+        _results.append(self)
+        return result
+
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    @pytest.fixture
+    def benchmark(request):
+        return SimpleBenchmark(request.node.name)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _results:
+        return
+    terminalreporter.section("benchmarks (install pytest-benchmark for full statistics)")
+    for result in _results:
+        timings = [t * 1000 for t in result.timings]
+        terminalreporter.write_line(
+            f"{result.name}: min {min(timings):.2f} ms, median {statistics.median(timings):.2f} ms, "
+            f"max {max(timings):.2f} ms over {len(timings)} rounds"
+        )
+        for name, value in result.extra_info.items():
+            terminalreporter.write_line(f"    {name}: {value}")
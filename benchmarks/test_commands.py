@@ -0,0 +1,41 @@
+"""Command dispatch: parsing, routing and running quick commands."""
+import pytest
+from desktop4mistral.commands import Commands
+
+MESSAGES = [
+    "What is the capital of France?",
+    "/read notes.txt tail 20",
+    "/wiki_search Alan Turing",
+    "/cache",
+    "/stats",
+    "/unknown command",
+]
+
+
+@pytest.fixture(scope="module")
+def commands():
+    return Commands()
+
+
+def test_parse(benchmark, commands):
+    def route():
+        return [commands.parse(message) for message in MESSAGES]
+
+    parsed = benchmark(route)
+    assert parsed[0] is None and parsed[1] == ("/read", "notes.txt tail 20")
+
+
+def test_instant_command(benchmark, commands):
+    assert benchmark(commands.run, "/temperature", "", []).startswith("There's no model")
+
+
+def test_cache_stats(benchmark, commands):
+    assert "Entries" in benchmark(commands.run, "/cache", "", [])
+
+
+def test_search(benchmark, commands):
+    """/search over a thousand saved messages."""
+    session = commands.sessions.create_session()
+    for number in range(1000):
+        commands.sessions.append(session, "user", f"Message {number} about the history of computing and Alan Turing")
+    assert "Turing" in benchmark(commands.run, "/search", "Turing computing", [])
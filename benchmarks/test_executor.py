@@ -0,0 +1,56 @@
+"""Cold and warm execute_python_code latency."""
+import itertools
+import time
+import pytest
+from desktop4mistral.mistral.executor import PythonExecutor
+
+CODE = "import math\nprint(math.factorial(20))"
+OUTPUT = "2432902008176640000\n"
+# Time for a started worker to finish booting, as it has in the app
+# between startup and the first tool call
+BOOT_SECONDS = 1.0
+
+
+@pytest.fixture
+def executor():
+    executor = PythonExecutor()
+    yield executor
+    executor.shutdown()
+
+
+def test_cold(benchmark, executor):
+    """Nothing warmed up: each run starts a new interpreter first."""
+    sessions = itertools.count()
+
+    def run():
+        session = next(sessions)
+        try:
+            return executor.run(CODE, session=session)
+        finally:
+            executor.reset_session(session)
+
+    def setup():
+        # Drop the worker the last run started in the background
+        executor.shutdown()
+
+    stdout, _ = benchmark.pedantic(run, setup=setup, rounds=5)
+    assert stdout == OUTPUT
+
+
+def test_warm(benchmark, executor):
+    """A new session taking a worker that was started ahead of time."""
+    sessions = itertools.count()
+
+    def setup():
+        executor.warm_up()
+        time.sleep(BOOT_SECONDS)
+
+    stdout, _ = benchmark.pedantic(lambda: executor.run(CODE, session=next(sessions)), setup=setup, rounds=5)
+    assert stdout == OUTPUT
+
+
+def test_same_session(benchmark, executor):
+    """Follow-up runs in a session, reusing its worker and namespace."""
+    executor.run("total = 0")
+    stdout, _ = benchmark(executor.run, "total += 1\nprint(total > 0)")
+    assert stdout == "True\n"
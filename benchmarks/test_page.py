@@ -0,0 +1,108 @@
+"""The chat page: load time and the cost of appending messages, in the real window."""
+import os
+import statistics
+import time
+import pytest
+
+# ImportError too, since Qt fails that way when system libraries are missing
+pytest.importorskip("PySide6.QtWebEngineWidgets", exc_type=ImportError)
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+TIMEOUT = 30
+HISTORY = 500
+APPENDS = 1000
+
+
+def wait_until(condition, timeout=TIMEOUT):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("The page didn't respond in time")
+        QApplication.processEvents()
+        time.sleep(0.001)
+
+
+def flush(window):
+    """Waits until the page has run every script sent so far, layout included."""
+    done = []
+    window.chatDisplay.page().runJavaScript("document.body.offsetHeight", 0, done.append)
+    wait_until(lambda: done)
+
+
+@pytest.fixture(scope="module")
+def app():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    return QApplication.instance() or QApplication(["benchmarks", "--no-sandbox"])
+
+
+def open_window():
+    from desktop4mistral.chat_window import ChatWindow
+    window = ChatWindow()
+    window.show()
+    wait_until(lambda: window.pageReady)
+    return window
+
+
+@pytest.fixture
+def window(app, fake_api):
+    window = open_window()
+    yield window
+    window.close()
+
+
+def message(number):
+    return f"Message {number}, with some code:\n\n```python\nprint({number} * 2)\n```\n"
+
+
+def test_page_load(benchmark, app, fake_api):
+    """From creating the window to the page shell being ready."""
+    windows = []
+
+    def load():
+        windows.append(open_window())
+
+    try:
+        benchmark.pedantic(load, rounds=3)
+    finally:
+        for window in windows:
+            window.close()
+
+
+def test_resume_history(benchmark, window):
+    """Reopening a session of HISTORY messages until the page has shown them."""
+    session = window.sessionStore.create_session()
+    for number in range(HISTORY):
+        window.sessionStore.append(session, "user" if number % 2 == 0 else "assistant", message(number))
+
+    def resume():
+        window.resumeSession(session)
+        flush(window)
+
+    benchmark.pedantic(resume, rounds=3)
+
+
+def test_append_at_1k(benchmark, window):
+    """
+    The cost of one more message after APPENDS of them. Should stay flat
+    as the history grows, since the page only appends the new node.
+    """
+    timings = []
+    for number in range(APPENDS):
+        start = time.perf_counter()
+        window.addMessageToDisplay("You", message(number), window.COLORS["USER"])
+        flush(window)
+        timings.append(time.perf_counter() - start)
+    early = statistics.median(timings[:100]) * 1000
+    late = statistics.median(timings[-100:]) * 1000
+    benchmark.extra_info["first_100_median_ms"] = round(early, 2)
+    benchmark.extra_info["last_100_median_ms"] = round(late, 2)
+
+    numbers = iter(range(APPENDS, 10 ** 9))
+
+    def append():
+        window.addMessageToDisplay("You", message(next(numbers)), window.COLORS["USER"])
+        flush(window)
+
+    benchmark.pedantic(append, rounds=20)
+    # Re-rendering the whole history would grow several times over by now
+    assert late < early * 3 + 5
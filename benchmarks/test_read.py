@@ -0,0 +1,112 @@
+"""/read of large local and remote files: time, and peak memory."""
+import functools
+import subprocess
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from desktop4mistral.cache import FetchCache
+from desktop4mistral.commands import Commands
+
+FILE_MB = 64
+SELECTIONS = ["", " head 100", " tail 100", " grep ERROR", " lines 400000-400100"]
+
+# Prints the peak RSS in megabytes of reading argv[1], or of doing
+# everything else if it is empty. ru_maxrss carries over the parent's
+# peak on Linux, so VmHWM is used there instead.
+RSS_SCRIPT = """
+import sys
+from desktop4mistral.commands import Commands
+commands = Commands()
+if sys.argv[1]:
+    commands.run("/read", sys.argv[1], [])
+try:
+    with open("/proc/self/status") as f:
+        print(next(int(line.split()[1]) / 1024 for line in f if line.startswith("VmHWM:")))
+except OSError:
+    import resource
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024))
+"""
+
+
+@pytest.fixture(scope="module")
+def large_file(tmp_path_factory):
+    """A log of FILE_MB megabytes with an error every thousand lines."""
+    # .txt, so the file server sends it as text
+    path = tmp_path_factory.mktemp("read") / "large.txt"
+    line = "2024-01-01 12:00:00 INFO request handled in 12 ms by worker 3 for /api/items\n"
+    with open(path, "w", encoding="utf-8") as f:
+        for number in range(FILE_MB * 1024 * 1024 // len(line)):
+            f.write(line if number % 1000 else f"2024-01-01 12:00:00 ERROR failed request {number}\n")
+    return path
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def copyfile(self, source, outputfile):
+        try:
+            super().copyfile(source, outputfile)
+        except (BrokenPipeError, ConnectionResetError):
+            # /read hangs up once it has what it needs
+            pass
+
+
+@pytest.fixture(scope="module")
+def file_server(large_file):
+    """Serves the large file over HTTP."""
+    handler = functools.partial(QuietHandler, directory=str(large_file.parent))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/{large_file.name}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="module")
+def commands():
+    return Commands()
+
+
+@pytest.mark.parametrize("selection", SELECTIONS)
+def test_read_local(benchmark, commands, large_file, selection):
+    reply = benchmark(commands.run, "/read", f"{large_file}{selection}", [])
+    assert reply.endswith("What would you like me to do with the contents?")
+
+
+@pytest.mark.parametrize("selection", [" head 100", " tail 100"])
+def test_read_remote(benchmark, commands, file_server, selection):
+    """Uncached remote reads; the cache is cleared before every round."""
+    reply = benchmark.pedantic(
+        commands.run, args=("/read", f"{file_server}{selection}", []), setup=FetchCache.clear, rounds=3
+    )
+    assert reply.endswith("What would you like me to do with the contents?")
+
+
+def peak_rss_mb(env, argument=""):
+    """Peak RSS of a fresh interpreter running RSS_SCRIPT, in megabytes."""
+    output = subprocess.run(
+        [sys.executable, "-c", RSS_SCRIPT, argument], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.split()[-1])
+
+
+@pytest.fixture(scope="module")
+def baseline_rss(subprocess_env):
+    if sys.platform == "win32":
+        pytest.skip("needs /proc or the resource module")
+    return peak_rss_mb(subprocess_env)
+
+
+@pytest.mark.parametrize("selection", SELECTIONS)
+def test_read_peak_rss(large_file, subprocess_env, baseline_rss, record_property, selection):
+    """Peak RSS of a fresh interpreter reading the file, over one that doesn't."""
+    baseline = baseline_rss
+    peak = peak_rss_mb(subprocess_env, f"{large_file}{selection}")
+    record_property("peak_rss_mb", round(peak, 1))
+    record_property("baseline_rss_mb", round(baseline, 1))
+    print(f"/read{selection}: peak RSS {peak:.1f} MB, {peak - baseline:+.1f} MB over not reading")
+    if "grep" not in selection:
+        # grep scans a memory map of the whole file, whose pages count as resident
+        assert peak - baseline < FILE_MB / 2
@@ -0,0 +1,62 @@
+"""Render cost against history length, without the window."""
+import pytest
+from desktop4mistral.markdown_handler import MarkdownConverter
+from desktop4mistral.sessions import SessionStore
+
+# As ChatWindow.RESUME_TAIL, which can't be imported without Qt
+RESUME_TAIL = 100
+LENGTHS = [100, 1000, 10000]
+
+
+def message(number):
+    """A typical reply: a few sentences and a short code block, unique per number."""
+    return (
+        f"Message {number}. Here is how to **sum** a list in Python, with a short example:\n\n"
+        f"```python\nvalues = list(range({number}))\nprint(sum(values))\n```\n\n"
+        f"- It runs in linear time\n- It works on any iterable\n"
+    )
+
+
+@pytest.fixture(scope="module")
+def sessions(tmp_path_factory):
+    """A store holding one session of each length in LENGTHS."""
+    store = SessionStore(str(tmp_path_factory.mktemp("render") / "sessions.sqlite"))
+    ids = {}
+    for length in LENGTHS:
+        ids[length] = store.create_session()
+        for number in range(length):
+            store.append(ids[length], "user" if number % 2 == 0 else "assistant", message(number), "mistral-large-latest")
+    return store, ids
+
+
+def test_render_message(benchmark):
+    """The Markdown conversion every new message goes through."""
+    converter = MarkdownConverter()
+    counter = iter(range(10 ** 9))
+    html = benchmark(lambda: converter.convert(message(next(counter)), cache=False))
+    assert "<pre" in html
+
+
+@pytest.mark.parametrize("length", LENGTHS)
+def test_resume_session(benchmark, sessions, length):
+    """Reopening a session renders only its tail, so this should not grow with the length."""
+    store, ids = sessions
+    converter = MarkdownConverter()
+
+    def resume():
+        count = store.count(ids[length])
+        tail = store.read(ids[length], max(0, count - RESUME_TAIL), count)
+        return [converter.convert(m["content"], cache=False) for m in tail]
+
+    assert len(benchmark(resume)) == min(length, RESUME_TAIL)
+
+
+@pytest.mark.parametrize("length", [0, 1000])
+def test_save_message(benchmark, tmp_path, length):
+    """Saving a message to a session that already holds length messages."""
+    store = SessionStore(str(tmp_path / "sessions.sqlite"))
+    session = store.create_session()
+    for number in range(length):
+        store.append(session, "user", message(number))
+    counter = iter(range(length, 10 ** 9))
+    benchmark(lambda: store.append(session, "user", message(next(counter))))
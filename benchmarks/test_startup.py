@@ -0,0 +1,41 @@
+"""Startup time of fresh interpreters."""
+import json
+import subprocess
+import sys
+import pytest
+
+PROFILE_SCRIPT = """
+import json
+from desktop4mistral.main import profile_imports
+print(json.dumps(profile_imports()))
+"""
+
+
+def run_python(env, *args):
+    return subprocess.run([sys.executable, *args], env=env, capture_output=True, text=True, check=True).stdout
+
+
+def test_import_client(benchmark, subprocess_env):
+    """What batch mode loads before it can send anything."""
+    benchmark.pedantic(
+        run_python, args=(subprocess_env, "-c", "import desktop4mistral.batch"), rounds=5, warmup_rounds=1
+    )
+
+
+def test_help(benchmark, subprocess_env):
+    """The command line, which should stay cheap to start."""
+    output = benchmark.pedantic(
+        run_python, args=(subprocess_env, "-m", "desktop4mistral.main", "--help"), rounds=5, warmup_rounds=1
+    )
+    assert "--batch" in output
+
+
+def test_import_window(benchmark, subprocess_env):
+    """Import time of each module the window needs, as --profile-startup reports it."""
+    # ImportError too, since Qt fails that way when system libraries are missing
+    pytest.importorskip("PySide6.QtWebEngineWidgets", exc_type=ImportError)
+    timings = benchmark.pedantic(
+        lambda: json.loads(run_python(subprocess_env, "-c", PROFILE_SCRIPT)), rounds=3, warmup_rounds=1
+    )
+    for name, seconds in timings:
+        benchmark.extra_info[f"import {name} (ms)"] = round(seconds * 1000, 1)
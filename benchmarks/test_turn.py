@@ -0,0 +1,33 @@
+"""End-to-end turn latency against the fake server."""
+from desktop4mistral.metrics import Metrics
+
+
+def percentile_50(name):
+    spans, _ = Metrics.summary()
+    return next((round(p50, 2) for span, _, p50, _, _ in spans if span == name), None)
+
+
+def test_streamed_turn(benchmark, client):
+    def turn():
+        return "".join(client.sendChatMessage([{"role": "user", "content": "Hello"}], stream=True))
+
+    reply = benchmark.pedantic(turn, rounds=10, warmup_rounds=1)
+    benchmark.extra_info["first_token_p50_ms"] = percentile_50("chat.first_token")
+    assert reply
+
+
+def test_blocking_turn(benchmark, client):
+    def turn():
+        return client.sendChatMessage([{"role": "user", "content": "Hello"}])
+
+    assert benchmark.pedantic(turn, rounds=10, warmup_rounds=1)
+
+
+def test_tool_call_turn(benchmark, client):
+    """A turn where the model runs Python before answering: two requests and a tool run."""
+    def turn():
+        return client.sendChatMessage([{"role": "user", "content": "!python print(6 * 7)"}])
+
+    reply = benchmark.pedantic(turn, rounds=5, warmup_rounds=1)
+    benchmark.extra_info["tool_p50_ms"] = percentile_50("tool.execute_python_code")
+    assert "42" in reply
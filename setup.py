@@ -22,16 +22,19 @@ setup(
         "PySide6",
         "requests",
         "markdown",
+        "pygments",
         "wikipedia",
         "markdownify",
-        "git2string",
         "str2speech>=0.3.0",
         "sounddevice",
         "scipy",
     ],
+    extras_require={
+        "bench": ["pytest", "pytest-benchmark"],
+    },
     include_package_data=True,
     package_data={
-        "desktop4mistral": ["fonts/*.ttf"],
+        "desktop4mistral": ["fonts/*.ttf", "assets/*"],
     },
     entry_points={
         "console_scripts": [
@@ -0,0 +1,212 @@
+// Only a window of at most MAX_NODES messages is kept in the DOM. Older or
+// newer messages are requested from Python through the web channel as the
+// user scrolls, and spacers sized from cached heights stand in for the rest.
+var MAX_NODES = 150;
+var PAGE = 50;
+var LOAD_MARGIN = 1500;
+var DEFAULT_HEIGHT = 120;
+
+var first = 0;
+var last = -1;
+var total = 0;
+var heights = {};
+var loading = false;
+var bridge = null;
+
+if (window.QWebChannel && window.qt) {
+    new QWebChannel(qt.webChannelTransport, function (channel) {
+        bridge = channel.objects.bridge;
+    });
+}
+
+function messages() {
+    return document.getElementById("messages");
+}
+
+function scrollToBottom() {
+    window.scrollTo(0, document.body.scrollHeight);
+}
+
+function isAtBottom() {
+    return window.innerHeight + window.scrollY >= document.body.scrollHeight - 40;
+}
+
+function heightOf(index) {
+    return heights[index] !== undefined ? heights[index] : DEFAULT_HEIGHT;
+}
+
+function measure(node) {
+    var style = window.getComputedStyle(node);
+    heights[node.dataset.index] = node.offsetHeight + parseFloat(style.marginBottom);
+}
+
+function updateSpacers() {
+    var top = 0;
+    for (var i = 0; i < first; i++) {
+        top += heightOf(i);
+    }
+    var bottom = 0;
+    for (var j = last + 1; j < total; j++) {
+        bottom += heightOf(j);
+    }
+    document.getElementById("top-spacer").style.height = top + "px";
+    document.getElementById("bottom-spacer").style.height = bottom + "px";
+}
+
+// Sends how long a page update took, layout included, to the stats
+function reportTiming(name, start) {
+    if (bridge) {
+        bridge.recordTiming(name, performance.now() - start);
+    }
+}
+
+function createNode(html, index) {
+    var node = document.createElement("div");
+    node.className = "message";
+    node.dataset.index = index;
+    node.innerHTML = html;
+    return node;
+}
+
+// Runs change() without moving the message the user is looking at
+function keepingPosition(change) {
+    var anchor = null;
+    var nodes = messages().children;
+    for (var i = 0; i < nodes.length; i++) {
+        if (nodes[i].getBoundingClientRect().bottom > 0) {
+            anchor = nodes[i];
+            break;
+        }
+    }
+    var before = anchor ? anchor.getBoundingClientRect().top : 0;
+    change();
+    if (anchor && anchor.parentNode) {
+        window.scrollBy(0, anchor.getBoundingClientRect().top - before);
+    }
+}
+
+function trimTop() {
+    var container = messages();
+    while (container.children.length > MAX_NODES) {
+        measure(container.firstElementChild);
+        container.removeChild(container.firstElementChild);
+        first++;
+    }
+}
+
+function trimBottom() {
+    var container = messages();
+    while (container.children.length > MAX_NODES) {
+        measure(container.lastElementChild);
+        container.removeChild(container.lastElementChild);
+        last--;
+    }
+}
+
+function appendMessage(html, index) {
+    total = index + 1;
+    if (last !== index - 1) {
+        // The newest messages are not in the DOM; jump back to the end
+        messages().innerHTML = "";
+        first = Math.max(0, total - PAGE);
+        last = first - 1;
+        updateSpacers();
+        if (bridge) {
+            loading = true;
+            bridge.requestMessages(first, total, "reset");
+        }
+        return;
+    }
+    var start = performance.now();
+    var node = createNode(html, index);
+    messages().appendChild(node);
+    last = index;
+    measure(node);
+    trimTop();
+    updateSpacers();
+    scrollToBottom();
+    reportTiming("dom.append", start);
+}
+
+function replaceMessage(html, index) {
+    var node = messages().querySelector('[data-index="' + index + '"]');
+    if (!node) {
+        // Out of the window; Python has the new HTML for when it is paged in
+        return;
+    }
+    var start = performance.now();
+    var follow = isAtBottom();
+    node.innerHTML = html;
+    measure(node);
+    if (follow) {
+        scrollToBottom();
+    }
+    reportTiming("dom.replace", start);
+}
+
+function insertMessages(start, htmls, position) {
+    var started = performance.now();
+    var container = messages();
+    if (position === "top") {
+        keepingPosition(function () {
+            var before = container.firstElementChild;
+            for (var i = 0; i < htmls.length; i++) {
+                var node = createNode(htmls[i], start + i);
+                container.insertBefore(node, before);
+                measure(node);
+            }
+            first = start;
+            trimBottom();
+            updateSpacers();
+        });
+    } else {
+        var reset = position === "reset";
+        keepingPosition(function () {
+            for (var i = 0; i < htmls.length; i++) {
+                var node = createNode(htmls[i], start + i);
+                container.appendChild(node);
+                measure(node);
+            }
+            last = start + htmls.length - 1;
+            trimTop();
+            updateSpacers();
+        });
+        if (reset) {
+            scrollToBottom();
+        }
+    }
+    loading = false;
+    reportTiming("dom.insert", started);
+}
+
+// Shows the newest messages of a resumed session; older ones are paged in
+function loadHistory(count, start, htmls) {
+    clearMessages();
+    total = count;
+    first = start;
+    last = start - 1;
+    insertMessages(start, htmls, "reset");
+}
+
+function clearMessages() {
+    messages().innerHTML = "";
+    first = 0;
+    last = -1;
+    total = 0;
+    heights = {};
+    updateSpacers();
+}
+
+window.addEventListener("scroll", function () {
+    if (loading || !bridge) {
+        return;
+    }
+    if (first > 0 && window.scrollY < document.getElementById("top-spacer").offsetHeight + LOAD_MARGIN) {
+        loading = true;
+        bridge.requestMessages(Math.max(0, first - PAGE), first, "top");
+    } else if (last < total - 1 &&
+               window.scrollY + window.innerHeight > document.getElementById("bottom-spacer").offsetTop - LOAD_MARGIN) {
+        loading = true;
+        bridge.requestMessages(last + 1, Math.min(total, last + 1 + PAGE), "bottom");
+    }
+});
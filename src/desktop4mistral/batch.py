@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .cancellation import CancelToken, Cancelled
+from .blobs import BlobStore
+from .commands import Commands
+from .mistral.client import Client
+from .mistral.ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRunner:
+    """
+    Runs conversations from a JSONL file without the window. Each line is
+    one conversation: {"id": ..., "prompt": "..." or ["...", "..."],
+    "model": ..., "temperature": ...}, where every prompt is a turn and
+    may be a command such as /read. Conversations run side by side on a
+    bounded pool, sharing a rate limiter, and each result is appended to
+    the output as soon as it is done. Conversations already in the output
+    are skipped, so an interrupted batch picks up where it stopped.
+    """
+    WORKERS = 4
+    DEFAULT_MODEL = "mistral-large-latest"
+
+    def __init__(self, input_path, output_path=None, workers=None, per_minute=None, model=None, temperature=None):
+        self.input_path = input_path
+        self.output_path = output_path or os.path.splitext(input_path)[0] + ".results.jsonl"
+        self.workers = workers or self.WORKERS
+        self.model = model or self.DEFAULT_MODEL
+        self.temperature = temperature
+        self.rate_limiter = RateLimiter(per_minute)
+        self.cancel_token = CancelToken()
+        self.local = threading.local()
+        self.clients = []
+        self.lock = threading.Lock()
+
+    def read_conversations(self):
+        """Returns the conversations of the input file, each with an id."""
+        conversations = []
+        with open(self.input_path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                conversation = json.loads(line)
+                conversation.setdefault("id", str(number))
+                if isinstance(conversation.get("prompt"), str):
+                    conversation["prompt"] = [conversation["prompt"]]
+                conversations.append(conversation)
+        return conversations
+
+    def read_finished(self):
+        """Returns the ids that already have a result without an error."""
+        finished = set()
+        if not os.path.exists(self.output_path):
+            return finished
+        with open(self.output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # The last line may be cut short if the batch was killed
+                    continue
+                if result.get("error"):
+                    finished.discard(result["id"])
+                else:
+                    finished.add(result["id"])
+        return finished
+
+    def _get_worker_state(self):
+        """Each pool thread gets its own client and commands."""
+        if not hasattr(self.local, "client"):
+            client = Client()
+            client.rate_limiter = self.rate_limiter
+            client.listModels()
+            commands = Commands()
+            client.setDocumentIndex(commands.index)
+            commands.set_client(client)
+            self.local.client, self.local.commands = client, commands
+            with self.lock:
+                self.clients.append(client)
+        return self.local.client, self.local.commands
+
+    def run_conversation(self, conversation):
+        client, commands = self._get_worker_state()
+        client.setModel(conversation.get("model") or self.model)
+        client.temperature = conversation.get("temperature", self.temperature)
+        client.python.reset_session()
+        commands.index.clear_session()
+        messages = [{"role": "system", "content": commands.system_prompt()}]
+        responses = []
+        start = time.perf_counter()
+        for prompt in conversation["prompt"]:
+            self.cancel_token.raise_if_cancelled()
+            messages.append({"role": "user", "content": prompt})
+            command = commands.parse(prompt)
+            if command:
+                response = commands.run(*command, messages)
+            else:
+                response = client.sendChatMessage(messages, cancel_token=self.cancel_token)
+            messages.append({"role": "assistant", "content": BlobStore.compact(response)})
+            responses.append(Commands.remove_hidden(response))
+        return {
+            "id": conversation["id"],
+            "model": client.model_id,
+            "responses": responses,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+    def write_result(self, output, result):
+        with self.lock:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    def run(self):
+        """Runs every unfinished conversation and returns the number that failed."""
+        conversations = self.read_conversations()
+        finished = self.read_finished()
+        pending = [c for c in conversations if c["id"] not in finished]
+        logger.info("%d conversations, %d already done", len(conversations), len(conversations) - len(pending))
+
+        started = time.perf_counter()
+        done = failed = 0
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            with open(self.output_path, "a", encoding="utf-8") as output:
+                futures = {executor.submit(self.run_conversation, c): c for c in pending}
+                for future in as_completed(futures):
+                    conversation = futures[future]
+                    try:
+                        result = future.result()
+                    except Cancelled:
+                        continue
+                    except Exception as e:
+                        logger.warning("Conversation %s failed: %s", conversation["id"], e)
+                        result = {"id": conversation["id"], "error": str(e)}
+                        failed += 1
+                    self.write_result(output, result)
+                    done += 1
+        except KeyboardInterrupt:
+            print("Stopping; run the same command again to resume.")
+            self.cancel_token.cancel()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            for client in self.clients:
+                client.python.shutdown()
+
+        minutes = (time.perf_counter() - started) / 60
+        print(
+            f"{done} of {len(pending)} conversations done, {failed} failed, "
+            f"{len(conversations) - len(pending)} skipped, in {minutes * 60:.1f}s "
+            f"({done / minutes if minutes else 0:.1f} conversations/minute). "
+            f"Results are in {self.output_path}."
+        )
+        return failed
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import threading
+import weakref
+import zlib
+from .commands import Commands
+from .utils import Utils
+
+HIDDEN_START = Commands.HIDDEN_IDENTIFIER_START
+HIDDEN_END = Commands.HIDDEN_IDENTIFIER_END
+
+
+class BlobRef:
+    """Stands in for a payload held in the BlobStore."""
+    __slots__ = ("digest", "length", "__weakref__")
+
+    def __init__(self, digest, length):
+        self.digest = digest
+        self.length = length
+
+
+class CompactContent:
+    """
+    The content of a message whose hidden payload lives in the BlobStore:
+    the visible text before and after it, and a reference to the payload.
+    """
+    __slots__ = ("before", "ref", "after")
+
+    def __init__(self, before, ref, after):
+        self.before = before
+        self.ref = ref
+        self.after = after
+
+    def __len__(self):
+        return len(self.before) + len(HIDDEN_START) + self.ref.length + len(HIDDEN_END) + len(self.after)
+
+    def text(self):
+        return self.before + HIDDEN_START + BlobStore.get(self.ref) + HIDDEN_END + self.after
+
+    def replace_payload(self, note):
+        """Returns the text with the payload replaced by note, without reading it."""
+        return self.before + note + self.after
+
+
+class BlobStore:
+    """
+    Large hidden payloads of messages, such as files and repos read with
+    commands, held once per distinct content. Payloads are compressed,
+    and once more than MAX_MEMORY bytes are held the oldest are spilled
+    to disk. A payload is dropped when the last message using it is.
+    """
+    # Payloads shorter than this stay inline in the message
+    MIN_SIZE = 2048
+    MAX_MEMORY = 32 * 1024 * 1024
+
+    # Reentrant, since a payload can be dropped while the lock is held
+    _lock = threading.RLock()
+    _refs = weakref.WeakValueDictionary()
+    _memory = {}
+    _spilled = set()
+    _memory_bytes = 0
+
+    @staticmethod
+    def get_spill_path():
+        path = os.path.join(Utils.get_cache_path(), "blobs")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def put(text):
+        """
+        Static method to store text, returning the BlobRef shared by every
+        copy of the same text.
+        """
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with BlobStore._lock:
+            ref = BlobStore._refs.get(digest)
+            if ref is not None:
+                return ref
+            ref = BlobRef(digest, len(text))
+            compressed = zlib.compress(data, 1)
+            BlobStore._memory[digest] = compressed
+            BlobStore._memory_bytes += len(compressed)
+            BlobStore._refs[digest] = ref
+            weakref.finalize(ref, BlobStore._drop, digest)
+            BlobStore._spill()
+        return ref
+
+    @staticmethod
+    def get(ref):
+        with BlobStore._lock:
+            compressed = BlobStore._memory.get(ref.digest)
+        if compressed is None:
+            with open(os.path.join(BlobStore.get_spill_path(), ref.digest), "rb") as f:
+                compressed = f.read()
+        return zlib.decompress(compressed).decode("utf-8")
+
+    @staticmethod
+    def _spill():
+        # Dicts keep insertion order, so the oldest payloads go first
+        while BlobStore._memory_bytes > BlobStore.MAX_MEMORY and BlobStore._memory:
+            digest = next(iter(BlobStore._memory))
+            compressed = BlobStore._memory.pop(digest)
+            with open(os.path.join(BlobStore.get_spill_path(), digest), "wb") as f:
+                f.write(compressed)
+            BlobStore._memory_bytes -= len(compressed)
+            BlobStore._spilled.add(digest)
+
+    @staticmethod
+    def _drop(digest):
+        with BlobStore._lock:
+            if BlobStore._refs.get(digest) is not None:
+                # Stored again since; the new reference owns the payload
+                return
+            compressed = BlobStore._memory.pop(digest, None)
+            if compressed is not None:
+                BlobStore._memory_bytes -= len(compressed)
+            spilled = digest in BlobStore._spilled
+            BlobStore._spilled.discard(digest)
+        if spilled:
+            try:
+                os.remove(os.path.join(BlobStore.get_spill_path(), digest))
+            except OSError:
+                pass
+
+    @staticmethod
+    def compact(content):
+        """
+        Static method to move the hidden payload of content into the
+        store. Returns a CompactContent, or content itself if it has no
+        payload worth moving.
+        """
+        if not isinstance(content, str):
+            return content
+        start = content.find(HIDDEN_START)
+        if start == -1:
+            return content
+        end = content.find(HIDDEN_END, start)
+        if end - start - len(HIDDEN_START) < BlobStore.MIN_SIZE:
+            return content
+        payload = content[start + len(HIDDEN_START):end]
+        return CompactContent(content[:start], BlobStore.put(payload), content[end + len(HIDDEN_END):])
+
+    @staticmethod
+    def materialize(messages):
+        """
+        Static method to get messages with every CompactContent turned
+        back into text, ready to be serialized.
+        """
+        return [
+            {**message, "content": message["content"].text()}
+            if isinstance(message.get("content"), CompactContent) else message
+            for message in messages
+        ]
+
+    @staticmethod
+    def stats():
+        with BlobStore._lock:
+            return {
+                "blobs": len(BlobStore._refs),
+                "memory_bytes": BlobStore._memory_bytes,
+                "spilled": len(BlobStore._spilled),
+            }
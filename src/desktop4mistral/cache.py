@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from .utils import Utils
+
+
+class CacheEntry:
+    __slots__ = ("value", "etag", "last_modified", "created")
+
+    def __init__(self, value, etag, last_modified, created):
+        self.value = value
+        self.etag = etag
+        self.last_modified = last_modified
+        self.created = created
+
+
+class DiskCache:
+    """
+    A size-bounded, least-recently-used cache of text values stored
+    compressed in SQLite. Entries can carry an ETag and Last-Modified
+    value for revalidation.
+    """
+    # SQLite limits how many values one statement can take
+    BATCH_SIZE = 500
+
+    def __init__(self, name, max_bytes):
+        self.path = os.path.join(Utils.get_cache_path(), f"{name}.sqlite")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # A cache can afford to lose its last writes on power loss, so commits skip the fsync
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, value BLOB, etag TEXT, last_modified TEXT,
+                size INTEGER, created REAL, accessed REAL
+            )"""
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+        )
+
+    def get(self, key, max_age=None):
+        """Returns the CacheEntry for key, or None if missing or older than max_age."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, etag, last_modified, created FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None or (max_age is not None and time.time() - row[3] > max_age):
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key)
+                )
+        value, etag, last_modified, created = row
+        return CacheEntry(zlib.decompress(value).decode("utf-8"), etag, last_modified, created)
+
+    def get_many(self, keys, max_age=None):
+        """
+        Returns a dict of key to CacheEntry for the keys that are cached and
+        not older than max_age, updating their access times in one commit.
+        """
+        keys = list(dict.fromkeys(keys))
+        rows = []
+        with self._lock:
+            for i in range(0, len(keys), self.BATCH_SIZE):
+                batch = keys[i:i + self.BATCH_SIZE]
+                rows += self._connection.execute(
+                    "SELECT key, value, etag, last_modified, created FROM entries "
+                    f"WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+            now = time.time()
+            if max_age is not None:
+                rows = [row for row in rows if now - row[4] <= max_age]
+            self.hits += len(rows)
+            self.misses += len(keys) - len(rows)
+            if rows:
+                with self._connection:
+                    self._connection.executemany(
+                        "UPDATE entries SET accessed = ? WHERE key = ?", [(now, row[0]) for row in rows]
+                    )
+        return {
+            key: CacheEntry(zlib.decompress(value).decode("utf-8"), etag, last_modified, created)
+            for key, value, etag, last_modified, created in rows
+        }
+
+    def put(self, key, value, etag=None, last_modified=None):
+        blob = zlib.compress(value.encode("utf-8"))
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, blob, etag, last_modified, len(blob), now, now),
+            )
+            self._evict()
+
+    def refresh(self, key):
+        """Marks an entry as revalidated, resetting its age."""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE entries SET created = ?, accessed = ? WHERE key = ?", (now, now, key)
+            )
+
+    def _evict(self):
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._connection.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            count, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {"entries": count, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries")
+        self.hits = 0
+        self.misses = 0
+
+
+class FetchCache:
+    """
+    The shared cache of fetched and converted content: remote /read
+    results, Wikipedia pages as Markdown and Wikipedia searches. In
+    offline mode, cached content is served regardless of age and nothing
+    is fetched.
+    """
+    MAX_BYTES = 256 * 1024 * 1024
+    offline = False
+
+    _cache = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_cache():
+        with FetchCache._lock:
+            if FetchCache._cache is None:
+                FetchCache._cache = DiskCache("fetch", FetchCache.MAX_BYTES)
+            return FetchCache._cache
+
+    @staticmethod
+    def get_offline():
+        return FetchCache.offline
+
+    @staticmethod
+    def set_offline(value):
+        FetchCache.offline = value
+
+    @staticmethod
+    def get(key, max_age=None):
+        if FetchCache.offline:
+            max_age = None
+        return FetchCache.get_cache().get(key, max_age)
+
+    @staticmethod
+    def put(key, value, etag=None, last_modified=None):
+        FetchCache.get_cache().put(key, value, etag, last_modified)
+
+    @staticmethod
+    def refresh(key):
+        FetchCache.get_cache().refresh(key)
+
+    @staticmethod
+    def stats():
+        return FetchCache.get_cache().stats()
+
+    @staticmethod
+    def clear():
+        FetchCache.get_cache().clear()
+
+
+class ResponseCache:
+    """
+    Opt-in cache of model replies, keyed by a hash of the whole request:
+    model, messages, tools and settings. When on, only deterministic
+    turns are cached, meaning temperature 0 and no tool calls. When
+    forced, every reply that isn't a tool call is cached.
+    """
+    MAX_BYTES = 64 * 1024 * 1024
+    MAX_AGE = 7 * 24 * 60 * 60
+    MODES = ("off", "on", "force")
+    mode = "off"
+
+    _cache = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_cache():
+        with ResponseCache._lock:
+            if ResponseCache._cache is None:
+                ResponseCache._cache = DiskCache("responses", ResponseCache.MAX_BYTES)
+            return ResponseCache._cache
+
+    @staticmethod
+    def get_mode():
+        return ResponseCache.mode
+
+    @staticmethod
+    def set_mode(mode):
+        if mode not in ResponseCache.MODES:
+            raise ValueError(f"Unknown response cache mode: {mode}")
+        ResponseCache.mode = mode
+
+    @staticmethod
+    def key(config, temperature, tools_called):
+        """
+        Static method to get the cache key for a request, or None if it
+        shouldn't be cached.
+        """
+        if ResponseCache.mode == "off":
+            return None
+        if ResponseCache.mode == "on" and (temperature != 0 or tools_called):
+            return None
+        request = {name: value for name, value in config.items() if name != "stream"}
+        canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get(key):
+        entry = ResponseCache.get_cache().get(key, ResponseCache.MAX_AGE)
+        return entry.value if entry else None
+
+    @staticmethod
+    def put(key, value):
+        ResponseCache.get_cache().put(key, value)
+
+    @staticmethod
+    def stats():
+        return ResponseCache.get_cache().stats()
+
+    @staticmethod
+    def clear():
+        ResponseCache.get_cache().clear()
@@ -0,0 +1,53 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Cancelled(Exception):
+    """Raised when work is aborted through its CancelToken."""
+
+
+class CancelToken:
+    """
+    A thread-safe flag shared between the GUI and a worker. Callbacks
+    registered with on_cancel run when the token is cancelled, which is
+    how open HTTP streams and child processes get aborted.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Cancel callback failed")
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+    def on_cancel(self, callback):
+        """Registers a callback, running it right away if already cancelled."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        """Unregisters a callback that is no longer needed."""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
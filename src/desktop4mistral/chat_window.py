@@ -5,43 +5,148 @@ from PySide6.QtWidgets import (
     QHBoxLayout,
     QTextEdit,
     QPushButton,
+    QDockWidget,
+    QLineEdit,
+    QListWidget,
+    QListWidgetItem,
 )
 from PySide6.QtWebEngineWidgets import QWebEngineView
-from PySide6.QtCore import Qt, QEvent, Signal, QObject, QThread
+from PySide6.QtWebChannel import QWebChannel
+from PySide6.QtCore import Qt, QEvent, Signal, Slot, QObject, QRunnable, QThreadPool, QTimer, QUrl
 from PySide6.QtGui import QFontDatabase, QAction, QTextCursor
 from .__init__ import __app_title__
 from .markdown_handler import MarkdownConverter
 from .mistral.client import Client
 from .commands import Commands
-import pkg_resources
+from .transport import Transport
+from .cancellation import CancelToken, Cancelled
+from importlib.resources import files, as_file
 from .state import State
-from .speaker import Speaker
+from .metrics import Metrics
+from .blobs import BlobStore
+import json
+import logging
+import threading
+import time
 
-class ResponseWorker(QObject):
-    finished = Signal(str)
-    
-    def __init__(self, mistral_client, commands_handler, chat_contents):
+logger = logging.getLogger(__name__)
+
+class WorkerSignals(QObject):
+    finished = Signal(object)
+    partial = Signal(str, str)
+    progress = Signal(str)
+
+
+class ResponseWorker(QRunnable):
+    # Minimum delay between two partial updates, in seconds
+    PARTIAL_INTERVAL = 0.05
+
+    def __init__(self, mistral_client, commands_handler, markdown_converter, chat_contents, command=None):
         super().__init__()
         self.mistral_client = mistral_client
         self.commands_handler = commands_handler
-        self.chat_contents = chat_contents        
-        
-    def process(self):
-        response = self.commands_handler.handle_command(self.chat_contents)
-        if response:
-            self.finished.emit(response)
-            return
-        
+        self.markdown_converter = markdown_converter
+        self.chat_contents = chat_contents
+        # (name, argument) of a slow command to run instead of a chat request
+        self.command = command
+        self.cancel_token = CancelToken()
+        self.signals = WorkerSignals()
+        self.setAutoDelete(False)
+
+    def run(self):
+        # finished must always be emitted, or the window keeps waiting on this worker
+        try:
+            response = self.respond()
+        except Exception as e:
+            logger.exception("Response failed")
+            response = f"Error: {str(e)}"
+        try:
+            self.render(response)
+        except Exception:
+            logger.exception("Couldn't render the response ahead of time")
+        self.signals.finished.emit(response)
+
+    def render(self, response):
+        """Convert the response now so the GUI thread finds it in the cache"""
+        self.markdown_converter.convert(self.commands_handler.remove_hidden(response))
+
+    def progress(self, message):
+        """Report progress, stopping the command here if it was cancelled"""
+        self.cancel_token.raise_if_cancelled()
+        self.signals.progress.emit(message)
+
+    def respond(self):
+        if self.command:
+            try:
+                with Transport.cancellable(self.cancel_token):
+                    return self.commands_handler.run(*self.command, self.chat_contents, self.progress)
+            except Cancelled:
+                return "*Stopped.*"
+            except Exception as e:
+                logger.exception("Command %s failed", self.command[0])
+                return f"Error: {str(e)}"
+
+        response = ""
+        try:
+            last_emit = 0.0
+            for delta in self.mistral_client.sendChatMessage(
+                self.chat_contents, stream=True, cancel_token=self.cancel_token
+            ):
+                response += delta
+                now = time.monotonic()
+                if now - last_emit >= self.PARTIAL_INTERVAL:
+                    html = self.markdown_converter.convert(response, cache=False)
+                    self.signals.partial.emit(response, html)
+                    last_emit = now
+            return response
+        except Cancelled:
+            return (response + "\n\n*Stopped.*").strip()
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+
+class ModelsWorker(QRunnable):
+    def __init__(self, mistral_client):
+        super().__init__()
+        self.mistral_client = mistral_client
+        self.signals = WorkerSignals()
+        self.setAutoDelete(False)
+
+    def run(self):
         try:
-            response = self.mistral_client.sendChatMessage(self.chat_contents)
-            self.finished.emit(response)
+            self.mistral_client.refreshModels()
+            self.signals.finished.emit(True)
         except Exception as e:
-            self.finished.emit(f"Error: {str(e)}")
+            logger.warning("Couldn't refresh models: %s", e)
+            self.signals.finished.emit(False)
+
+
+class ChatBridge(QObject):
+    """Object exposed to the chat page so it can page messages in on scroll"""
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+
+    @Slot(int, int, str)
+    def requestMessages(self, start, end, position):
+        self.window.sendMessagesToPage(start, end, position)
+
+    @Slot(str, float)
+    def recordTiming(self, name, milliseconds):
+        Metrics.record(name, milliseconds)
 
 
 class ChatWindow(QMainWindow):
     response_received = Signal(str)
 
+    # Upper bound on requests, fetches and speech running at once
+    MAX_WORKERS = 4
+    # Messages loaded right away when a session is reopened
+    RESUME_TAIL = 100
+    # Pause in typing before the search sidebar runs a query
+    SEARCH_DELAY_MS = 150
+
     COLORS = {
         "USER": "#b0b0ff",
         "SYSTEM": "#ffb0b0",
@@ -55,7 +160,10 @@ class ChatWindow(QMainWindow):
 
         self.mistralClient = Client()
         self.speaker = None
+        self.speakerLock = threading.Lock()
         self.commandsHandler = Commands()
+        self.mistralClient.setDocumentIndex(self.commandsHandler.index)
+        self.commandsHandler.set_client(self.mistralClient)
         self.markdownConverter = MarkdownConverter()
         self.setWindowTitle(__app_title__)
         self.setGeometry(100, 100, 1280, 720)
@@ -64,33 +172,36 @@ class ChatWindow(QMainWindow):
             "role": "system",
             "content": self.commandsHandler.system_prompt()
         }]
-        self.chat_html = ""
+        self.isClosing = False
+        self.sessionStore = self.commandsHandler.sessions
+        self.sessionId = None
+        self.savedDocuments = []
+        self.worker = None
+        self.modelsWorker = None
+        self.threadPool = QThreadPool()
+        self.threadPool.setMaxThreadCount(self.MAX_WORKERS)
         self.initFonts()
         self.initUI()
         self.initMenu()
 
         self.response_received.connect(self.handleResponse)
-        self.chatDisplay.loadFinished.connect(self.scrollToBottom)
 
         self.set_model("mistral-large-latest", None)
-        
-        self.thread = None
-        self.worker = None
-        self.isClosing = False
+
+        self.streamingIndex = None
 
     def initFonts(self):
         """Load custom font for the application"""
-        font_path = pkg_resources.resource_filename(
-            "desktop4mistral", "fonts/FiraCode-VariableFont_wght.ttf"
-        )
-        font_id = QFontDatabase.addApplicationFont(font_path)
+        font = files("desktop4mistral") / "fonts" / "FiraCode-VariableFont_wght.ttf"
+        with as_file(font) as font_path:
+            font_id = QFontDatabase.addApplicationFont(str(font_path))
 
         if font_id == -1:
-            print("Failed to load font. Falling back to default.")
+            logger.warning("Failed to load font. Falling back to default.")
             self.fontFamily = "courier"
         else:
             self.fontFamily = QFontDatabase.applicationFontFamilies(font_id)[0]
-            print(f"Loaded font: {self.fontFamily}")
+            logger.info("Loaded font: %s", self.fontFamily)
 
     def initMenu(self):
         """Initialize the application menu bar"""
@@ -100,12 +211,28 @@ class ChatWindow(QMainWindow):
         new_action = QAction("New", self)
         new_action.triggered.connect(self.new_chat)
         file_menu.addAction(new_action)
+        self.sessionsMenu = file_menu.addMenu("Open Recent")
+        self.sessionsMenu.aboutToShow.connect(self.populateSessionsMenu)
         file_menu.addSeparator()
         exit_action = QAction("Exit", self)
         exit_action.triggered.connect(self.close)
         file_menu.addAction(exit_action)
 
-        models_menu = menu_bar.addMenu("Models")
+        view_menu = menu_bar.addMenu("View")
+        search_action = self.searchDock.toggleViewAction()
+        search_action.setShortcut("Ctrl+Shift+F")
+        view_menu.addAction(search_action)
+
+        self.modelsMenu = menu_bar.addMenu("Models")
+        self.modelActions = []
+        self.populateModelsMenu()
+
+        if self.mistralClient.isModelsCacheStale():
+            self.refreshModelsInBackground()
+
+    def populateModelsMenu(self):
+        """Fill the Models menu from the client's model list"""
+        self.modelsMenu.clear()
         self.modelActions = []
 
         for model in self.mistralClient.listModels():
@@ -116,36 +243,53 @@ class ChatWindow(QMainWindow):
                 lambda checked, m=model, a=model_action: self.set_model(m, a)
             )
             self.modelActions.append(model_action)
-            models_menu.addAction(model_action)
+            self.modelsMenu.addAction(model_action)
 
-        print("Models list initialized")
+        logger.info("Models list initialized")
+
+    def refreshModelsInBackground(self):
+        """Fetch a fresh model list without blocking the window"""
+        self.modelsWorker = ModelsWorker(self.mistralClient)
+        self.modelsWorker.signals.finished.connect(self.handleModelsRefreshed)
+        self.threadPool.start(self.modelsWorker)
+
+    def handleModelsRefreshed(self, ok):
+        """Rebuild the Models menu once the fresh list arrives"""
+        if ok and not self.isClosing:
+            self.populateModelsMenu()
 
     def set_model(self, model, _):
         """Set the current Mistral model"""
         self.mistralClient.setModel(model)
-        print(f"Switched to {model}")
+        logger.info("Switched to %s", model)
 
         for action in self.modelActions:
             action.setChecked(action.text() == model)
 
-        for item in self.mistralClient.model_data:
-            if item["id"] == model:
-                system_message = f"Now using {item['id']}\n\n{item['description']}\n\n"
-                if item["default_model_temperature"]:
-                    system_message += f"- Temperature: {item['default_model_temperature']}\n"
-                if item["max_context_length"]:
-                    system_message += f"- Max Context Length: {item['max_context_length']}\n\n"
-                system_message += "Ready."
-                self.addSystemMessage(system_message)
-                break
+        item = self.mistralClient.getModel(model)
+        if item:
+            system_message = f"Now using {item['id']}\n\n{item['description']}\n\n"
+            if item["default_model_temperature"]:
+                system_message += f"- Temperature: {item['default_model_temperature']}\n"
+            if item["max_context_length"]:
+                system_message += f"- Max Context Length: {item['max_context_length']}\n\n"
+            system_message += "Ready."
+            self.addSystemMessage(system_message)
 
     def new_chat(self):
         """Clear the chat display and start a new conversation"""
-        self.chat_html = ""
-        self.chatDisplay.setHtml("")
+        self.stopResponse(discard=True)
+        self.displayedMessages = []
+        self.sessionId = None
+        self.savedDocuments = []
+        self.runScript("clearMessages();")
+        self.stopSpeaking()
+        self.mistralClient.python.reset_session()
+        self.mistralClient.context.clear()
+        self.commandsHandler.index.clear_session()
         self.inputField.clear()
         self.chatContents = [{
-            "role": "user",
+            "role": "system",
             "content": self.commandsHandler.system_prompt()
         }]
 
@@ -170,6 +314,7 @@ class ChatWindow(QMainWindow):
             """
         )
         layout.addWidget(self.chatDisplay, stretch=1)
+        self.initPage()
 
         # Input area
         input_widget = QWidget()
@@ -228,10 +373,92 @@ class ChatWindow(QMainWindow):
 
         send_button.clicked.connect(self.sendMessage)
         input_layout.addWidget(send_button)
+
+        self.stopButton = QPushButton("Stop")
+        self.stopButton.setStyleSheet(
+            f"""
+            QPushButton {{
+                background-color: #ff6b6b;
+                color: #ffffff;
+                border: none;
+                border-radius: 6px;
+                padding: 8px 16px;
+                font-family: "{self.fontFamily}", courier;
+                font-size: 16px;
+                font-weight: 500;
+            }}
+            QPushButton:hover {{
+                background-color: #ff8080;
+            }}
+            QPushButton:pressed {{
+                background-color: #d45a5a;
+            }}
+            QPushButton:disabled {{
+                background-color: #454545;
+                color: #808080;
+            }}
+        """
+        )
+        self.stopButton.setEnabled(False)
+        self.stopButton.clicked.connect(lambda: self.stopResponse())
+        input_layout.addWidget(self.stopButton)
         layout.addWidget(input_widget)
 
         self.inputField.installEventFilter(self)
-        print("UI initialized")
+        self.initSearch()
+        logger.info("UI initialized")
+
+    def initSearch(self):
+        """Sidebar that searches every saved conversation as you type"""
+        self.searchDock = QDockWidget("Search", self)
+        self.searchDock.setObjectName("searchDock")
+        search_widget = QWidget()
+        search_layout = QVBoxLayout(search_widget)
+        search_layout.setContentsMargins(6, 6, 6, 6)
+
+        self.searchField = QLineEdit()
+        self.searchField.setPlaceholderText("Search conversations...")
+        self.searchResults = QListWidget()
+        self.searchResults.setWordWrap(True)
+        self.searchResults.setToolTip("Double-click a result to bring it into this conversation")
+        for widget in (self.searchField, self.searchResults):
+            widget.setStyleSheet(
+                f"""
+                background-color: #353535;
+                color: #e0e0e0;
+                border: 1px solid #454545;
+                font-family: "{self.fontFamily}", courier;
+                font-size: 14px;
+                """
+            )
+        search_layout.addWidget(self.searchField)
+        search_layout.addWidget(self.searchResults, stretch=1)
+        self.searchDock.setWidget(search_widget)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.searchDock)
+        self.searchDock.hide()
+
+        self.searchTimer = QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(self.SEARCH_DELAY_MS)
+        self.searchTimer.timeout.connect(self.runSearch)
+        self.searchField.textChanged.connect(self.searchTimer.start)
+        self.searchResults.itemActivated.connect(self.recallSearchResult)
+
+    def runSearch(self):
+        """Fill the sidebar with the best matches for the search field"""
+        self.searchResults.clear()
+        for hit in self.sessionStore.search(self.searchField.text(), prefix=True):
+            item = QListWidgetItem(f"{hit['title']}\n{hit['snippet']}")
+            item.setData(Qt.UserRole, (hit["session"], hit["position"]))
+            self.searchResults.addItem(item)
+
+    def recallSearchResult(self, item):
+        """Bring a search result into the current conversation"""
+        if self.worker:
+            return
+        session_id, position = item.data(Qt.UserRole)
+        self.inputField.setText(f"/recall {session_id}:{position}")
+        self.sendMessage()
 
     def eventFilter(self, obj, event):
         """Handle keyboard events for the input field"""
@@ -243,94 +470,193 @@ class ChatWindow(QMainWindow):
                 return True
         return super().eventFilter(obj, event)
 
-    def scrollToBottom(self, ok=True):
-        """Scroll the chat display to the bottom after content is loaded"""
-        if ok:
-            self.chatDisplay.page().runJavaScript("window.scrollTo(0, document.body.scrollHeight);")
-
-    first_message = True
-    def addMessageToDisplay(self, sender, message, color):
-        """Add a message to the chat display with appropriate formatting"""
-        styles_and_scripts = """
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/an-old-hope.min.css"/>
-        <style>
-            body {
-                font-family: "Roboto", sans-serif;";
-                font-size: 16px;
-                margin: 0;
-                padding: 10px;
-                background-color: #2f2f2f;
-                border-radius: 16px;
-                border: solid 1px #00b4ff;
-            }
-            pre {
-                font-family: "Fira Code", courier;
-                white-space: pre-wrap;
-            }
-            code {
-                font-family: "Fira Code", courier;
-            }
-            ul {
-                list-style-type: square;
-            }
-        </style>
-        <link rel="preconnect" href="https://fonts.googleapis.com">
-        <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-        <link href="https://fonts.googleapis.com/css2?family=Fira+Code:wght@300..700&family=Roboto:ital,wght@0,100..900;1,100..900&display=swap" rel="stylesheet">        
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/highlight.min.js"></script>
-        """
-        message_html = f"""
-        <div style="margin-bottom: 16px;">
-            <span style="color: {color}; font-weight: bold;">{sender}</span>
-            <div style="color: {self.COLORS['TEXT']};">
-                {self.formatMessageContent(message)}
-            </div>
+    def scrollToBottom(self):
+        """Scroll the chat display to the bottom"""
+        self.runScript("window.scrollTo(0, document.body.scrollHeight);")
+
+    def initPage(self):
+        """Load the page shell once; messages are appended to it via JavaScript"""
+        self.pageReady = False
+        self.pendingScripts = []
+        # Every message shown, as HTML; the page only keeps a window of them
+        self.displayedMessages = []
+        self.bridge = ChatBridge(self)
+        self.channel = QWebChannel(self.chatDisplay.page())
+        self.channel.registerObject("bridge", self.bridge)
+        self.chatDisplay.page().setWebChannel(self.channel)
+        self.chatDisplay.loadFinished.connect(self.onPageLoaded)
+        assets = files("desktop4mistral") / "assets"
+        page = (assets / "chat.html").read_text(encoding="utf-8")
+        page = page.replace("/* PYGMENTS_CSS */", MarkdownConverter.get_css())
+        # Relative links in the page resolve to the bundled assets and fonts
+        self.chatDisplay.setHtml(page, QUrl.fromLocalFile(str(files("desktop4mistral")) + "/"))
+
+    def onPageLoaded(self, ok=True):
+        """Flush any messages that were added before the shell finished loading"""
+        if not ok:
+            return
+        self.pageReady = True
+        if self.pendingScripts:
+            self.chatDisplay.page().runJavaScript(";".join(self.pendingScripts))
+            self.pendingScripts = []
+        self.scrollToBottom()
+
+    def runScript(self, script):
+        """Run a script in the chat page, queueing it until the shell is ready"""
+        if self.pageReady:
+            self.chatDisplay.page().runJavaScript(script)
+        else:
+            self.pendingScripts.append(script)
+
+    def messageHtml(self, sender, color, content_html):
+        return f"""
+        <span style="color: {color}; font-weight: bold;">{sender}</span>
+        <div style="color: {self.COLORS['TEXT']};">
+            {content_html}
         </div>
         """
-        
-        if self.first_message:
-            self.chat_html = f"<html><head>{styles_and_scripts}</head><body>{message_html}</body></html>"
-            self.first_message = False
+
+    def storedMessageHtml(self, message):
+        """Render a message read back from the session store"""
+        if message["role"] == "user":
+            return self.messageHtml("You", self.COLORS["USER"], self.formatMessageContent(message["content"]))
+        return self.messageHtml(
+            message["model"] or "Assistant", self.COLORS["ASSISTANT"],
+            self.formatMessageContent(self.removeHidden(message["content"]))
+        )
+
+    def addMessageToDisplay(self, sender, message, color, replace_index=None, html=None):
+        """Add a message to the chat display, or replace the one at replace_index; returns its index"""
+        message_html = self.messageHtml(
+            sender, color, html if html is not None else self.formatMessageContent(message)
+        )
+        if replace_index is not None and replace_index < len(self.displayedMessages):
+            index = replace_index
+            self.displayedMessages[index] = message_html
+            function = "replaceMessage"
         else:
-            self.chat_html = self.chat_html.replace("</body></html>", f"{message_html}<script>hljs.highlightAll();</script></body></html>")
-        
-        self.chatDisplay.setHtml(self.chat_html)
+            self.displayedMessages.append(message_html)
+            index = len(self.displayedMessages) - 1
+            function = "appendMessage"
+        self.runScript(f"{function}({json.dumps(message_html)}, {index});")
+        return index
+
+    def sendMessagesToPage(self, start, end, position):
+        """Give the page the stored messages it asked for while scrolling"""
+        start = max(0, start)
+        end = min(end, len(self.displayedMessages))
+        if self.sessionId is not None and None in self.displayedMessages[start:end]:
+            stored = self.sessionStore.read(self.sessionId, start, end)
+            for i, message in enumerate(stored, start):
+                if self.displayedMessages[i] is None:
+                    self.displayedMessages[i] = self.storedMessageHtml(message)
+        self.runScript(
+            f"insertMessages({start}, {json.dumps(self.displayedMessages[start:end])}, {json.dumps(position)});"
+        )
 
     def formatMessageContent(self, message):
-        converted_message = self.markdownConverter.convert(message)
-        print(converted_message)
-        return converted_message
+        return self.markdownConverter.convert(message)
+
+    def saveMessage(self, role, content):
+        """Append a message to the current session on disk"""
+        if self.sessionId is None:
+            self.sessionId = self.sessionStore.create_session()
+        self.sessionStore.append(
+            self.sessionId, role, content, self.mistralClient.model_id, self.removeHidden(content)
+        )
+        documents = self.commandsHandler.index.session_documents
+        if documents != self.savedDocuments:
+            # Kept with the session, so resuming it brings back its excerpts
+            self.sessionStore.set_documents(self.sessionId, documents)
+            self.savedDocuments = list(documents)
+
+    def resumeSession(self, session_id):
+        """Reopen a saved session, loading only its newest messages"""
+        self.new_chat()
+        count = self.sessionStore.count(session_id)
+        start = max(0, count - self.RESUME_TAIL)
+        tail = self.sessionStore.read(session_id, start, count)
+        self.sessionId = session_id
+        self.savedDocuments = self.sessionStore.get_documents(session_id)
+        self.commandsHandler.index.restore_session(self.savedDocuments)
+        self.chatContents += [{"role": m["role"], "content": BlobStore.compact(m["content"])} for m in tail]
+        self.displayedMessages = [None] * start + [self.storedMessageHtml(m) for m in tail]
+        self.runScript(
+            f"loadHistory({count}, {start}, {json.dumps(self.displayedMessages[start:])});"
+        )
+
+    def populateSessionsMenu(self):
+        """List recent sessions in the File menu"""
+        self.sessionsMenu.clear()
+        for session_id, title, _, count in self.sessionStore.list_sessions():
+            action = QAction(f"{title} ({count})", self)
+            action.triggered.connect(lambda checked, s=session_id: self.resumeSession(s))
+            self.sessionsMenu.addAction(action)
 
     def addUserMessage(self, message):
         """Add a user message to the chat history and display"""
         self.chatContents.append({"role": "user", "content": message})
+        self.saveMessage("user", message)
         self.addMessageToDisplay("You", message, self.COLORS["USER"])
 
     def addAssistantMessage(self, message):
         """Add an assistant message to the chat history and display"""
-        self.chatContents.append({"role": "assistant", "content": message})
+        self.chatContents.append({"role": "assistant", "content": BlobStore.compact(message)})
+        self.saveMessage("assistant", message)
         formatted_message = self.removeHidden(message)
         if State.get_talk_mode():
-            if not self.speaker:
-                self.speaker = Speaker()
-            self.speaker.speak(formatted_message)
+            self.threadPool.start(lambda: self.speak(formatted_message))
         self.addMessageToDisplay(
-            self.mistralClient.model_id, formatted_message, self.COLORS["ASSISTANT"]
+            self.mistralClient.model_id, formatted_message, self.COLORS["ASSISTANT"],
+            replace_index=self.streamingIndex
         )
+        self.streamingIndex = None
+
+    def speak(self, message):
+        """Queue a message for speech; runs on the thread pool since loading the TTS model is slow"""
+        with self.speakerLock:
+            if not self.speaker:
+                from .speaker import Speaker
+                self.speaker = Speaker()
+            self.speaker.speak(message)
+
+    def stopSpeaking(self):
+        """Interrupt any speech that is playing or queued"""
+        if self.speaker:
+            self.speaker.stop()
 
     def removeHidden(self, message):
-        if self.commandsHandler.HIDDEN_IDENTIFIER_START in message:
-            start_index = message.index(self.commandsHandler.HIDDEN_IDENTIFIER_START)
-            end_index = message.index(self.commandsHandler.HIDDEN_IDENTIFIER_END)
-            message = message[:start_index] + message[end_index + len(self.commandsHandler.HIDDEN_IDENTIFIER_END):]
-        return message.strip()
+        return self.commandsHandler.remove_hidden(message)
 
     def addSystemMessage(self, message):
         """Add a system message to the display (not added to chat history)"""
         self.addMessageToDisplay("System", message, self.COLORS["SYSTEM"])
 
+    def isFromWorker(self):
+        """Whether the signal being handled came from the current worker, not one stopped by New"""
+        return self.worker is not None and self.sender() is self.worker.signals
+
+    def handlePartialResponse(self, response, html):
+        """Update the assistant message in place while it streams in"""
+        if self.isClosing or not self.isFromWorker():
+            return
+        # Tracked by index, since system messages can be added while it streams
+        self.streamingIndex = self.addMessageToDisplay(
+            self.mistralClient.model_id, response, self.COLORS["ASSISTANT"],
+            replace_index=self.streamingIndex, html=html
+        )
+
+    def handleProgress(self, message):
+        """Show progress of a slow command in the input field"""
+        if not self.isClosing and self.isFromWorker():
+            self.inputField.setText(message)
+
     def handleResponse(self, response):
         """Safely handle response from the worker thread"""
+        if not self.isFromWorker():
+            return
+        self.worker = None
+        self.stopButton.setEnabled(False)
         if not self.isClosing:
             self.addAssistantMessage(response)
             self.inputField.clear()
@@ -339,47 +665,64 @@ class ChatWindow(QMainWindow):
 
     def sendMessage(self):
         """Send the user message and get a response"""
+        if self.worker:
+            return
+
         user_message = self.inputField.toPlainText().strip()
         if not user_message:
             return
 
+        self.stopSpeaking()
         self.addUserMessage(user_message)
 
+        command = self.commandsHandler.parse(user_message)
+        if command and self.commandsHandler.is_instant(*command):
+            self.inputField.clear()
+            try:
+                response = self.commandsHandler.run(*command, self.chatContents)
+            except Exception as e:
+                logger.exception("Command %s failed", command[0])
+                response = f"Error: {str(e)}"
+            self.addAssistantMessage(response)
+            return
+
         self.inputField.clear()
         self.inputField.setText("Waiting for response...")
         self.inputField.setEnabled(False)
+        self.stopButton.setEnabled(True)
 
-        self.cleanupThread()
-        
-        self.thread = QThread()
-        self.worker = ResponseWorker(self.mistralClient, self.commandsHandler, self.chatContents)
-        self.worker.moveToThread(self.thread)
-        
-        self.thread.started.connect(self.worker.process)
-        self.worker.finished.connect(self.handleResponse)
-        self.worker.finished.connect(self.cleanupThread)
-        
-        self.thread.start()
-
-    def cleanupThread(self):
-        """Safely clean up thread and worker"""
-        if self.thread and self.thread.isRunning():
-            self.thread.quit()
-            self.thread.wait()
-            
-        # Reset references
-        self.thread = None
-        self.worker = None
+        self.worker = ResponseWorker(
+            self.mistralClient, self.commandsHandler, self.markdownConverter, self.chatContents, command
+        )
+        self.worker.signals.partial.connect(self.handlePartialResponse)
+        self.worker.signals.progress.connect(self.handleProgress)
+        self.worker.signals.finished.connect(self.handleResponse)
+        self.threadPool.start(self.worker)
+
+    def stopResponse(self, discard=False):
+        """
+        Abort the request that is currently in flight. Its partial reply is
+        still added to the chat, unless discard is set, as it is when the
+        chat is being replaced.
+        """
+        self.stopSpeaking()
+        if self.worker:
+            self.worker.cancel_token.cancel()
+            self.stopButton.setEnabled(False)
+            if discard:
+                self.worker = None
+                self.streamingIndex = None
+                self.inputField.setEnabled(True)
 
     def closeEvent(self, event):
         """Handle window close event"""
         self.isClosing = True
-        
-        if self.thread and self.thread.isRunning():
-            self.thread.quit()
-            self.thread.wait(1000)            
-            if self.thread.isRunning():
-                self.thread.terminate()
-                self.thread.wait()
-                
-        super().closeEvent(event)
\ No newline at end of file
+
+        if self.worker:
+            self.worker.cancel_token.cancel()
+        self.threadPool.clear()
+        self.threadPool.waitForDone(1000)
+
+        self.mistralClient.python.shutdown()
+        Transport.close()
+        super().closeEvent(event)
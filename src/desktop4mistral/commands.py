@@ -1,12 +1,87 @@
-import requests
-from .helpers.wikitomarkdown import WikiHelper
-from git2string.stringify import stringify_git
+from .helpers.docindex import DocumentIndex
+from .metrics import Metrics
+from .sessions import SessionStore
 from .state import State
 from .utils import Utils
+import logging
+import os
+import re
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+
+class Command:
+    """
+    How a command is handled. Instant commands are quick and run right
+    away on the GUI thread; the others run on the worker pool, where they
+    can report progress and be stopped. Arguments not matching the
+    pattern get the usage text back without running the handler.
+    """
+    def __init__(self, handler, usage, pattern, instant=False):
+        self.handler = handler
+        self.usage = usage
+        self.pattern = re.compile(pattern, re.DOTALL)
+        self.instant = instant
+
+    def accepts(self, argument):
+        return self.pattern.fullmatch(argument) is not None
+
 
 class Commands:
     HIDDEN_IDENTIFIER_START = "|6100|"
     HIDDEN_IDENTIFIER_END = "|6101|"
+    # Documents longer than this are indexed instead of pasted into the chat
+    INLINE_LIMIT = 8000
+    # The highest temperature the API accepts
+    MAX_TEMPERATURE = 1.5
+    # Maps each command to how it is handled. Handlers import what they
+    # need when first called, so unused commands cost nothing.
+    COMMANDS = {
+        "/read": Command("read_file", "/read <path or url> [head N|tail N|grep PATTERN|lines A-B]", r".+"),
+        "/wiki_id": Command("read_wiki", "/wiki_id <page id>", r".+"),
+        "/wiki_search": Command("search_wiki", "/wiki_search <query>", r".+"),
+        "/git": Command("read_git", "/git <repo> [include:...] [exclude:...]", r".+"),
+        "/talk": Command("talk", "/talk on|off", r"on|off", instant=True),
+        "/save": Command("save", "/save", r"", instant=True),
+        "/save_markdown": Command("save_markdown", "/save_markdown", r"", instant=True),
+        "/cache": Command(
+            "cache", "/cache [clear|offline on|offline off|responses on|responses off|responses force|responses clear]",
+            r"|clear|offline (on|off)|responses (on|off|force|clear)", instant=True
+        ),
+        "/search": Command("search", "/search <words>", r".+", instant=True),
+        "/recall": Command("recall", "/recall <session>:<message>", r"\d+:\d+", instant=True),
+        "/stats": Command("stats", "/stats [reset|export <file>|export off]", r"|reset|export .+", instant=True),
+        "/temperature": Command("temperature", "/temperature [<0 to 1.5>|default]", r"|default|\d+(\.\d+)?", instant=True),
+    }
+
+    def __init__(self):
+        self.index = DocumentIndex()
+        self.sessions = SessionStore()
+        self.handlers = {name: getattr(self, command.handler) for name, command in self.COMMANDS.items()}
+        # The client whose settings commands such as /temperature change
+        self.client = None
+
+    @staticmethod
+    def remove_hidden(message):
+        """Returns message without its hidden block, as shown to the user."""
+        start_index = message.find(Commands.HIDDEN_IDENTIFIER_START)
+        if start_index != -1:
+            # A start marker without an end, e.g. echoed by the model, hides nothing
+            end_index = message.find(Commands.HIDDEN_IDENTIFIER_END, start_index)
+            if end_index != -1:
+                message = message[:start_index] + message[end_index + len(Commands.HIDDEN_IDENTIFIER_END):]
+        return message.strip()
+
+    def set_client(self, client):
+        self.client = client
+
+    def index_document(self, source, contents):
+        """Returns contents, or a short note if the document was indexed instead."""
+        if len(contents) <= self.INLINE_LIMIT:
+            return contents
+        chunks = self.index.add(source, contents)
+        return f"[{source} is large, so it was split into {chunks} indexed parts. The relevant parts are included with each question.]"
 
     def system_prompt(self):
         return """
@@ -78,68 +153,211 @@ class Commands:
             },
         ]
 
-    def handle_command(self, messages):
-        message = messages[-1]["content"]
-        command = message.strip().split(" ")[0]
-        if not command.startswith("/"):
+    def parse(self, message):
+        """Returns (name, argument) if message is a known command, else None."""
+        message = message.strip()
+        name = message.split(maxsplit=1)[0] if message else ""
+        if name not in self.COMMANDS:
+            return None
+        return name, message[len(name):].strip()
+
+    def is_instant(self, name, argument):
+        """True if the command can answer without leaving the GUI thread."""
+        command = self.COMMANDS[name]
+        return command.instant or not command.accepts(argument)
+
+    def run(self, name, argument, messages, progress=None):
+        command = self.COMMANDS[name]
+        if not command.accepts(argument):
+            return f"Umm, I don't understand. Usage: `{command.usage}`"
+        with Metrics.span(f"command{name.replace('/', '.')}"):
+            return self.handlers[name](argument, messages, progress or (lambda message: None))
+
+    def handle_command(self, messages, progress=None):
+        parsed = self.parse(messages[-1]["content"])
+        if not parsed:
             return False
-        if command == "/read":
-            to_read = message[len(command):].strip()
+        return self.run(*parsed, messages, progress)
+
+    def read_file(self, argument, messages, progress):
+        from .helpers.filereader import FileReader
+        to_read, selection = FileReader.parse(argument)
+        try:
             if to_read.startswith("http://") or to_read.startswith("https://"):
-                print("Now reading remote file:" + to_read)
-                remote_file_contents = requests.get(to_read).text
-                remote_file_contents = f"""{self.HIDDEN_IDENTIFIER_START}The contents of {to_read} are:\n\n```\n{remote_file_contents}```\n\n{self.HIDDEN_IDENTIFIER_END}Done. What would you like me to do with the contents?"""
-                return remote_file_contents
-            print("Now reading local file:" + to_read)
-            try:
-                with open(to_read, "r") as f:
-                    contents = f.read()
-                    contents = f"""{self.HIDDEN_IDENTIFIER_START}The contents of {to_read} are:\n\n```\n{contents}```\n\n{self.HIDDEN_IDENTIFIER_END}Done. What would you like me to do with the contents?"""
-                    return contents
-            except FileNotFoundError:
-                return "I couldn't find that file."
-            except PermissionError:
-                return "I don't have permission to read that file."
-            except Exception as e:
-                return f"An unexpected error occurred: {e}"            
-        elif command == "/wiki_id":
-            to_read = message[len(command):].strip()
-            print("Now reading wiki:" + to_read)
-            success, contents = WikiHelper.convert_to_md(to_read)
-            if success:
-                return f"""{self.HIDDEN_IDENTIFIER_START}The contents of that wiki page are ```\n{contents}\n```\n{self.HIDDEN_IDENTIFIER_END} I have read the contents of that wiki page. You can now ask me questions about it."""
+                logger.info("Now reading remote file: %s", to_read)
+                success, contents = FileReader.read_remote(to_read, selection)
             else:
-                return "I couldn't read that wiki page."
-        elif command == "/wiki_search":
-            to_read = message[len(command):].strip()
-            print("Now searching wiki:" + to_read)
-            results = WikiHelper.search(to_read)
-            contents = "```\n"
-            for result in results:
-                contents += f"{result['pageid']} --> {result['title']}\n\n"
-            contents += "```\n\nPick an id and say /wiki_id <id> if you want me to read that page."
+                logger.info("Now reading local file: %s", to_read)
+                success, contents = FileReader.read_local(to_read, selection)
+        except FileNotFoundError:
+            return "I couldn't find that file."
+        except PermissionError:
+            return "I don't have permission to read that file."
+        except Exception as e:
+            return f"An unexpected error occurred: {e}"
+        if not success:
             return contents
-        elif command == "/git":
-            to_read = message[len(command):].strip()
-            print("Now reading git:" + to_read)
-            contents = stringify_git(to_read)
-            print(contents)
-            return f"""{self.HIDDEN_IDENTIFIER_START} The contents of that git repo are ```\n{contents}```\n{self.HIDDEN_IDENTIFIER_END}\nI have now read the contents of that repo."""
-        elif command == "/talk":
-            to_read = message[len(command):].strip()
-            if to_read == "on":
-                State.set_talk_mode(True)
-                return "Okay, I can talk now."
-            elif to_read == "off":
-                State.set_talk_mode(False)
-                return "Okay, I won't talk anymore."
-            else:
-                return "Umm, I don't understand. You can either say /talk on or /talk off."
-        elif command == "/save":
-            filename = Utils.to_json(messages)
-            return f"This conversation has been saved to {filename}."
-        elif command == "/save_markdown":
-            filename = Utils.to_markdown(messages)
-            return f"This conversation has been saved to {filename}."        
-
-        return False
\ No newline at end of file
+        contents = self.index_document(to_read, contents)
+        return f"""{self.HIDDEN_IDENTIFIER_START}The contents of {to_read} are:\n\n```\n{contents}```\n\n{self.HIDDEN_IDENTIFIER_END}Done. What would you like me to do with the contents?"""
+
+    def read_wiki(self, argument, messages, progress):
+        from .helpers.wikitomarkdown import WikiHelper
+        logger.info("Now reading wiki: %s", argument)
+        success, contents = WikiHelper.convert_to_md(argument)
+        if success:
+            contents = self.index_document(f"wiki page {argument}", contents)
+            return f"""{self.HIDDEN_IDENTIFIER_START}The contents of that wiki page are ```\n{contents}\n```\n{self.HIDDEN_IDENTIFIER_END} I have read the contents of that wiki page. You can now ask me questions about it."""
+        else:
+            return "I couldn't read that wiki page."
+
+    def search_wiki(self, argument, messages, progress):
+        from .helpers.wikitomarkdown import WikiHelper
+        logger.info("Now searching wiki: %s", argument)
+        results = WikiHelper.search(argument)
+        contents = "```\n"
+        for result in results:
+            contents += f"{result['pageid']} --> {result['title']}\n\n"
+        contents += "```\n\nPick an id and say /wiki_id <id> if you want me to read that page."
+        return contents
+
+    def read_git(self, argument, messages, progress):
+        from .helpers.gitreader import GitReader
+        to_read, includes, excludes = GitReader.parse(argument)
+        logger.info("Now reading git: %s", to_read)
+        try:
+            contents = GitReader.stringify(to_read, includes, excludes, progress)
+        except subprocess.CalledProcessError as e:
+            return f"I couldn't read that repo: {e.stderr.strip()}"
+        except FileNotFoundError:
+            return "I need git to be installed to read repos."
+        contents = self.index_document(to_read, contents)
+        return f"""{self.HIDDEN_IDENTIFIER_START} The contents of that git repo are ```\n{contents}```\n{self.HIDDEN_IDENTIFIER_END}\nI have now read the contents of that repo."""
+
+    def talk(self, argument, messages, progress):
+        if argument == "on":
+            State.set_talk_mode(True)
+            return "Okay, I can talk now."
+        elif argument == "off":
+            State.set_talk_mode(False)
+            return "Okay, I won't talk anymore."
+        else:
+            return "Umm, I don't understand. You can either say /talk on or /talk off."
+
+    def save(self, argument, messages, progress):
+        from .blobs import BlobStore
+        filename = Utils.to_json(BlobStore.materialize(messages))
+        return f"This conversation has been saved to {filename}."
+
+    def save_markdown(self, argument, messages, progress):
+        from .blobs import BlobStore
+        filename = Utils.to_markdown(BlobStore.materialize(messages))
+        return f"This conversation has been saved to {filename}."
+
+    def cache(self, argument, messages, progress):
+        from .cache import FetchCache, ResponseCache
+        if argument == "clear":
+            FetchCache.clear()
+            ResponseCache.clear()
+            return "Okay, I've cleared the cache."
+        elif argument in ("offline on", "offline off"):
+            FetchCache.set_offline(argument == "offline on")
+            return f"Okay, offline mode is {argument.split(' ')[1]}."
+        elif argument == "responses clear":
+            ResponseCache.clear()
+            return "Okay, I've cleared the cached replies."
+        elif argument.startswith("responses "):
+            ResponseCache.set_mode(argument.split(" ")[1])
+            return {
+                "on": "Okay, I'll reuse replies to repeated questions when the temperature is 0 and no tools are used. Use /temperature 0 to set it.",
+                "force": "Okay, I'll reuse replies to any repeated question.",
+                "off": "Okay, I won't reuse replies.",
+            }[ResponseCache.get_mode()]
+        stats = FetchCache.stats()
+        responses = ResponseCache.stats()
+        return (
+            f"Fetched content:\n\n"
+            f"- Entries: {stats['entries']}\n"
+            f"- Size: {stats['bytes'] / 1024:.1f} KB\n"
+            f"- Hits: {stats['hits']}\n"
+            f"- Misses: {stats['misses']}\n"
+            f"- Offline: {'on' if FetchCache.get_offline() else 'off'}\n\n"
+            f"Replies:\n\n"
+            f"- Mode: {ResponseCache.get_mode()}\n"
+            f"- Entries: {responses['entries']}\n"
+            f"- Size: {responses['bytes'] / 1024:.1f} KB\n"
+            f"- Hits: {responses['hits']}\n"
+            f"- Misses: {responses['misses']}"
+        )
+
+    def temperature(self, argument, messages, progress):
+        if self.client is None:
+            return "There's no model to set the temperature of."
+        if argument == "default":
+            self.client.temperature = None
+        elif argument:
+            temperature = float(argument)
+            if temperature > self.MAX_TEMPERATURE:
+                return f"The temperature can be at most {self.MAX_TEMPERATURE}."
+            self.client.temperature = temperature
+        if self.client.temperature is None:
+            return "The temperature is the model's default."
+        return f"The temperature is {self.client.temperature:g}."
+
+    def search(self, argument, messages, progress):
+        hits = self.sessions.search(argument, highlight=("**", "**"))
+        if not hits:
+            return "I couldn't find that in any saved conversation."
+        contents = ""
+        for hit in hits:
+            contents += f"- *{hit['title']}* (`/recall {hit['session']}:{hit['position']}`): {hit['snippet']}\n"
+        contents += "\nSay /recall followed by a reference if you want me to bring that message into this conversation."
+        return contents
+
+    def recall(self, argument, messages, progress):
+        try:
+            session_id, position = (int(part) for part in argument.split(":"))
+        except ValueError:
+            return "Umm, I don't understand. Say /recall <session>:<message>, as listed by /search."
+        recalled = self.sessions.read(session_id, position, position + 1)
+        if not recalled:
+            return "I couldn't find that message."
+        speaker = "the user" if recalled[0]["role"] == "user" else "you"
+        contents = self.remove_hidden(recalled[0]["content"])
+        return f"""{self.HIDDEN_IDENTIFIER_START}In an earlier conversation, {speaker} said:\n\n{contents}\n\n{self.HIDDEN_IDENTIFIER_END}I've recalled that message from an earlier conversation."""
+
+    def stats(self, argument, messages, progress):
+        from .transport import Transport
+        if argument == "reset":
+            Metrics.reset()
+            return "Okay, I've reset the stats."
+        elif argument == "export off":
+            Metrics.export_to(None)
+            return "Okay, I've stopped exporting timings."
+        elif argument.startswith("export "):
+            path = os.path.expanduser(argument[len("export "):].strip())
+            try:
+                Metrics.export_to(path)
+            except OSError as e:
+                return f"I couldn't open that file: {e}"
+            return f"Okay, every timing will now be appended to {path}."
+        spans, counters = Metrics.summary()
+        if not spans:
+            return "Nothing has been timed yet."
+        contents = "| Span | Count | p50 ms | p90 ms | p99 ms |\n|---|---|---|---|---|\n"
+        for name, count, *percentiles in spans:
+            contents += f"| {name} | {count} | " + " | ".join(f"{p:.1f}" for p in percentiles) + " |\n"
+        if counters.get("tokens.prompt"):
+            contents += f"\n- Prompt tokens: {counters['tokens.prompt']}\n"
+            contents += f"- Completion tokens: {counters.get('tokens.completion', 0)}\n"
+            if counters.get("chat.generation_ms"):
+                rate = counters.get("tokens.completion", 0) / (counters["chat.generation_ms"] / 1000)
+                contents += f"- Completion tokens per second: {rate:.1f}\n"
+        connections = Transport.get_stats()
+        contents += (
+            f"\n- HTTP requests: {connections['requests']}\n"
+            f"- New connections: {connections['new_connections']}\n"
+            f"- Reused connections: {connections['reused_connections']}\n"
+        )
+        if Metrics.get_export():
+            contents += f"\nExporting to {Metrics.get_export()}."
+        return contents
@@ -0,0 +1,243 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from ..utils import Utils
+
+
+class DocumentIndex:
+    """
+    An on-disk BM25 index over documents read with /read, /git and
+    /wiki_id. Documents are split into chunks once, and each question
+    only brings the best matching chunks of the documents read in the
+    current conversation into the request. Once the documents add up to
+    more than MAX_BYTES, the least recently read are dropped.
+    """
+    MAX_BYTES = 256 * 1024 * 1024
+    CHUNK_CHARS = 1500
+    OVERLAP_LINES = 2
+    TOP_K = 5
+    K1 = 1.5
+    B = 0.75
+    TOKEN = re.compile(r"\w\w+")
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(Utils.get_cache_path(), "index.sqlite")
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY, source TEXT, chunks INTEGER, created REAL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY, document TEXT, position INTEGER,
+                text TEXT, length INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS postings (term TEXT, chunk INTEGER, tf INTEGER);
+            CREATE INDEX IF NOT EXISTS postings_term ON postings (term);
+            CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document);
+            """
+        )
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(documents)")}
+        if "size" not in columns:
+            # Indexes made before documents were bounded
+            with self._connection:
+                self._connection.execute("ALTER TABLE documents ADD COLUMN size INTEGER")
+                self._connection.execute("ALTER TABLE documents ADD COLUMN accessed REAL")
+                self._connection.execute(
+                    """UPDATE documents SET accessed = created, size = (
+                        SELECT COALESCE(SUM(LENGTH(text)), 0) FROM chunks WHERE document = documents.id
+                    )"""
+                )
+        self.session_documents = []
+
+    @staticmethod
+    def tokenize(text):
+        return DocumentIndex.TOKEN.findall(text.lower())
+
+    @staticmethod
+    def split(text):
+        """Splits text into chunks of whole lines, overlapping by a few lines."""
+        chunks = []
+        lines = text.splitlines(keepends=True)
+        current = []
+        size = 0
+        for line in lines:
+            if current and size + len(line) > DocumentIndex.CHUNK_CHARS:
+                chunks.append("".join(current))
+                current = current[-DocumentIndex.OVERLAP_LINES:]
+                size = sum(len(l) for l in current)
+            current.append(line)
+            size += len(line)
+        if current:
+            chunks.append("".join(current))
+        return chunks
+
+    def add(self, source, text):
+        """Indexes a document and adds it to the session. Returns its chunk count."""
+        document_id = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT chunks FROM documents WHERE id = ?", (document_id,)
+            ).fetchone()
+            if row:
+                count = row[0]
+                with self._connection:
+                    self._connection.execute(
+                        "UPDATE documents SET accessed = ? WHERE id = ?", (time.time(), document_id)
+                    )
+            else:
+                count = self._insert(document_id, source, text)
+            if document_id in self.session_documents:
+                self.session_documents.remove(document_id)
+            self.session_documents.append(document_id)
+            if not row:
+                self._evict()
+        return count
+
+    def _evict(self):
+        """Drops the least recently read documents outside the session until under MAX_BYTES."""
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        if total <= self.MAX_BYTES:
+            return
+        victims = []
+        for document_id, size in self._connection.execute(
+            "SELECT id, size FROM documents ORDER BY accessed"
+        ).fetchall():
+            if total <= self.MAX_BYTES:
+                break
+            if document_id in self.session_documents:
+                continue
+            victims.append(document_id)
+            total -= size or 0
+        if not victims:
+            return
+        marks = ",".join("?" * len(victims))
+        with self._connection:
+            self._connection.execute(
+                f"DELETE FROM postings WHERE chunk IN (SELECT id FROM chunks WHERE document IN ({marks}))",
+                victims,
+            )
+            self._connection.execute(f"DELETE FROM chunks WHERE document IN ({marks})", victims)
+            self._connection.execute(f"DELETE FROM documents WHERE id IN ({marks})", victims)
+
+    def _insert(self, document_id, source, text):
+        chunks = self.split(text)
+        with self._connection:
+            for position, chunk in enumerate(chunks):
+                terms = Counter(self.tokenize(chunk))
+                cursor = self._connection.execute(
+                    "INSERT INTO chunks (document, position, text, length) VALUES (?, ?, ?, ?)",
+                    (document_id, position, chunk, sum(terms.values())),
+                )
+                self._connection.executemany(
+                    "INSERT INTO postings (term, chunk, tf) VALUES (?, ?, ?)",
+                    [(term, cursor.lastrowid, tf) for term, tf in terms.items()],
+                )
+            now = time.time()
+            self._connection.execute(
+                "INSERT INTO documents (id, source, chunks, created, size, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (document_id, source, len(chunks), now, len(text), now),
+            )
+        return len(chunks)
+
+    def search(self, query, k=None):
+        """Returns the top-k (source, text) chunks of the session's documents."""
+        k = k or self.TOP_K
+        with self._lock:
+            documents = list(self.session_documents)
+            if not documents:
+                return []
+            marks = ",".join("?" * len(documents))
+            total, average = self._connection.execute(
+                f"SELECT COUNT(*), AVG(length) FROM chunks WHERE document IN ({marks})",
+                documents,
+            ).fetchone()
+            if not total:
+                return []
+            average = average or 1
+
+            scores = Counter()
+            for term in set(self.tokenize(query)):
+                rows = self._connection.execute(
+                    f"""SELECT p.chunk, p.tf, c.length FROM postings p
+                    JOIN chunks c ON c.id = p.chunk
+                    WHERE p.term = ? AND c.document IN ({marks})""",
+                    [term] + documents,
+                ).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+                for chunk, tf, length in rows:
+                    norm = tf + self.K1 * (1 - self.B + self.B * length / average)
+                    scores[chunk] += idf * tf * (self.K1 + 1) / norm
+
+            if scores:
+                best = [chunk for chunk, _ in scores.most_common(k)]
+            else:
+                # Nothing matched, so fall back to the start of the latest document
+                best = [row[0] for row in self._connection.execute(
+                    "SELECT id FROM chunks WHERE document = ? ORDER BY position LIMIT ?",
+                    (documents[-1], k),
+                )]
+            marks = ",".join("?" * len(best))
+            rows = self._connection.execute(
+                f"""SELECT c.id, d.source, c.text FROM chunks c
+                JOIN documents d ON d.id = c.document WHERE c.id IN ({marks})""",
+                best,
+            ).fetchall()
+        order = {chunk: i for i, chunk in enumerate(best)}
+        rows.sort(key=lambda row: order[row[0]])
+        return [(source, text) for _, source, text in rows]
+
+    def augment(self, messages):
+        """Returns messages with the best chunks prepended to the last user message."""
+        if not self.session_documents:
+            return messages
+        # After a tool call the list ends with tool messages, but the question is the same
+        last = next((i for i in range(len(messages) - 1, -1, -1) if messages[i]["role"] == "user"), None)
+        if last is None:
+            return messages
+        question = messages[last]["content"]
+        results = self.search(question)
+        if not results:
+            return messages
+        excerpts = "\n\n".join(f"From {source}:\n```\n{text}```" for source, text in results)
+        content = (
+            f"Relevant excerpts from the documents you have read:\n\n{excerpts}\n\n"
+            f"Question: {question}"
+        )
+        return messages[:last] + [{**messages[last], "content": content}] + messages[last + 1:]
+
+    def restore_session(self, document_ids):
+        """
+        Makes the given documents the session's again, as when a saved
+        conversation is resumed. Returns how many are still in the index.
+        """
+        document_ids = list(document_ids)
+        with self._lock:
+            found = set()
+            if document_ids:
+                marks = ",".join("?" * len(document_ids))
+                found = {row[0] for row in self._connection.execute(
+                    f"SELECT id FROM documents WHERE id IN ({marks})", document_ids
+                )}
+            self.session_documents = [document_id for document_id in document_ids if document_id in found]
+            if self.session_documents:
+                now = time.time()
+                with self._connection:
+                    self._connection.executemany(
+                        "UPDATE documents SET accessed = ? WHERE id = ?",
+                        [(now, document_id) for document_id in self.session_documents],
+                    )
+            return len(self.session_documents)
+
+    def clear_session(self):
+        with self._lock:
+            self.session_documents = []
@@ -0,0 +1,196 @@
+import mmap
+import os
+import re
+from collections import deque
+from itertools import islice
+from ..transport import Transport
+from ..cache import FetchCache
+
+
+class FileReader:
+    """
+    Reads local and remote files without loading more than needed. Only
+    a slice of the file is returned: the first MAX_BYTES by default, or
+    the result of a head, tail, grep or lines selection.
+    """
+    MAX_BYTES = 256 * 1024
+    # Remote files are never downloaded past this, even for tail and grep
+    REMOTE_MAX_BYTES = 64 * 1024 * 1024
+    CHUNK_SIZE = 64 * 1024
+    SNIFF_BYTES = 8192
+    TEXT_CONTENT_TYPES = ("text/", "json", "xml", "javascript", "yaml", "csv", "markdown")
+    SELECTION = re.compile(r"^(?P<target>.+?)\s+(?P<mode>head|tail|grep|lines)\s+(?P<arg>.+)$")
+
+    @staticmethod
+    def parse(argument):
+        """Splits '/read' arguments into the target and an optional selection."""
+        match = FileReader.SELECTION.match(argument.strip())
+        if not match:
+            return argument.strip(), None
+        mode, arg = match.group("mode"), match.group("arg").strip()
+        if mode in ("head", "tail") and not arg.isdigit():
+            return argument.strip(), None
+        if mode == "lines" and not re.fullmatch(r"\d+-\d+", arg):
+            return argument.strip(), None
+        return match.group("target"), (mode, arg)
+
+    @staticmethod
+    def is_binary(sample):
+        if b"\0" in sample:
+            return True
+        try:
+            sample.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # A multi-byte character may have been cut at the end of the sample
+            return e.start < len(sample) - 4
+        return False
+
+    @staticmethod
+    def _decode(data, truncated, max_bytes):
+        text = data.decode("utf-8", errors="replace")
+        if truncated:
+            text += f"\n[Truncated at {max_bytes} bytes]"
+        return text
+
+    @staticmethod
+    def _select_lines(lines, selection, max_bytes):
+        """Applies a selection to an iterable of byte lines, keeping at most max_bytes."""
+        mode, arg = selection
+        if mode == "head":
+            kept = islice(lines, int(arg))
+        elif mode == "tail":
+            kept = deque(lines, maxlen=int(arg))
+        elif mode == "grep":
+            try:
+                pattern = re.compile(arg.encode("utf-8"))
+            except re.error:
+                pattern = re.compile(re.escape(arg.encode("utf-8")))
+            kept = (
+                f"{number}: ".encode("utf-8") + line
+                for number, line in enumerate(lines, 1)
+                if pattern.search(line)
+            )
+        else:
+            first, last = (int(n) for n in arg.split("-"))
+            kept = islice(lines, max(first - 1, 0), last)
+
+        output = bytearray()
+        for line in kept:
+            if len(output) + len(line) > max_bytes:
+                output += line[:max_bytes - len(output)]
+                return bytes(output), True
+            output += line
+        return bytes(output), False
+
+    @staticmethod
+    def _mmap_tail(mm, count):
+        end = len(mm)
+        if end and mm[end - 1:end] == b"\n":
+            end -= 1
+        start = end
+        for _ in range(count):
+            start = mm.rfind(b"\n", 0, start)
+            if start == -1:
+                return mm[:]
+        return mm[start + 1:]
+
+    @staticmethod
+    def read_local(path, selection=None, max_bytes=None):
+        """Returns (success, text) for a slice of a local file."""
+        max_bytes = max_bytes or FileReader.MAX_BYTES
+        with open(path, "rb") as f:
+            if FileReader.is_binary(f.read(FileReader.SNIFF_BYTES)):
+                return False, "That looks like a binary file, so I didn't read it."
+            f.seek(0)
+            size = os.fstat(f.fileno()).st_size
+
+            if selection and selection[0] == "tail" and size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    data = FileReader._mmap_tail(mm, int(selection[1]))
+                truncated = len(data) > max_bytes
+                return True, FileReader._decode(data[-max_bytes:], truncated, max_bytes)
+
+            if selection and selection[0] == "grep" and size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    data, truncated = FileReader._select_lines(
+                        iter(mm.readline, b""), selection, max_bytes
+                    )
+                return True, FileReader._decode(data, truncated, max_bytes)
+
+            if selection:
+                data, truncated = FileReader._select_lines(f, selection, max_bytes)
+            else:
+                data = f.read(max_bytes)
+                truncated = size > max_bytes
+            return True, FileReader._decode(data, truncated, max_bytes)
+
+    @staticmethod
+    def _iter_remote_lines(response):
+        read = 0
+        pending = b""
+        for chunk in response.iter_content(FileReader.CHUNK_SIZE):
+            read += len(chunk)
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+            if read >= FileReader.REMOTE_MAX_BYTES:
+                break
+        if pending:
+            yield pending
+
+    @staticmethod
+    def read_remote(url, selection=None, max_bytes=None):
+        """Returns (success, text) for a slice of a remote file, streamed in chunks.
+
+        Results are cached and revalidated with ETag/Last-Modified.
+        """
+        max_bytes = max_bytes or FileReader.MAX_BYTES
+        key = f"read:{url}:{selection}:{max_bytes}"
+        cached = FetchCache.get(key)
+        if FetchCache.get_offline():
+            if cached:
+                return True, cached.value
+            return False, "I'm offline and haven't read that file before."
+
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        with Transport.get(url, stream=True, headers=headers) as response:
+            if response.status_code == 304 and cached:
+                FetchCache.refresh(key)
+                return True, cached.value
+            success, text = FileReader._read_response(response, selection, max_bytes)
+            if success:
+                FetchCache.put(
+                    key, text,
+                    response.headers.get("ETag"), response.headers.get("Last-Modified")
+                )
+            return success, text
+
+    @staticmethod
+    def _read_response(response, selection, max_bytes):
+        response.raise_for_status()
+        content_type = response.headers.get("Content-Type", "").lower()
+        if content_type and not any(t in content_type for t in FileReader.TEXT_CONTENT_TYPES):
+            return False, f"That looks like a binary file ({content_type}), so I didn't read it."
+
+        if selection:
+            data, truncated = FileReader._select_lines(
+                FileReader._iter_remote_lines(response), selection, max_bytes
+            )
+            return True, FileReader._decode(data, truncated, max_bytes)
+
+        output = bytearray()
+        truncated = False
+        for chunk in response.iter_content(FileReader.CHUNK_SIZE):
+            if not output and FileReader.is_binary(chunk[:FileReader.SNIFF_BYTES]):
+                return False, "That looks like a binary file, so I didn't read it."
+            output += chunk
+            if len(output) > max_bytes:
+                truncated = True
+                break
+        return True, FileReader._decode(bytes(output[:max_bytes]), truncated, max_bytes)
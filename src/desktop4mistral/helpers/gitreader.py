@@ -0,0 +1,156 @@
+import fnmatch
+import hashlib
+import os
+import subprocess
+import time
+from ..cache import DiskCache
+from ..utils import Utils
+from .filereader import FileReader
+
+
+class GitReader:
+    """
+    Turns a git repository into text for the chat. Repositories are kept
+    as bare clones in the cache directory and only fetched incrementally,
+    and file contents are cached by blob id, so reading the same repo
+    again only reads files that changed.
+    """
+    MAX_FILE_BYTES = 100 * 1024
+    MAX_TOTAL_BYTES = 4 * 1024 * 1024
+    BLOB_CACHE_BYTES = 512 * 1024 * 1024
+    # A clone fetched more recently than this is not fetched again, in seconds
+    FETCH_INTERVAL = 60
+    DEFAULT_EXCLUDES = [
+        "*.lock", "*.min.js", "*.min.css", "*.map", "*.svg", "*.png", "*.jpg",
+        "*.jpeg", "*.gif", "*.ico", "*.pdf", "*.zip", "*.gz", "*.ttf", "*.woff*",
+        "package-lock.json", "yarn.lock",
+    ]
+
+    _blobs = None
+
+    @staticmethod
+    def get_blob_cache():
+        if GitReader._blobs is None:
+            GitReader._blobs = DiskCache("git_blobs", GitReader.BLOB_CACHE_BYTES)
+        return GitReader._blobs
+
+    @staticmethod
+    def parse(argument):
+        """Splits '/git' arguments into the repo and include/exclude globs."""
+        parts = argument.split()
+        repo = parts[0] if parts else ""
+        includes, excludes = [], []
+        for part in parts[1:]:
+            if part.startswith("include:"):
+                includes.extend(g for g in part[len("include:"):].split(",") if g)
+            elif part.startswith("exclude:"):
+                excludes.extend(g for g in part[len("exclude:"):].split(",") if g)
+        return repo, includes, excludes
+
+    @staticmethod
+    def _git(*args, cwd=None):
+        return subprocess.run(
+            ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+        ).stdout
+
+    @staticmethod
+    def _clone_path(repo):
+        name = hashlib.sha1(repo.encode("utf-8")).hexdigest()
+        path = os.path.join(Utils.get_cache_path(), "git")
+        os.makedirs(path, exist_ok=True)
+        return os.path.join(path, f"{name}.git")
+
+    @staticmethod
+    def update(repo):
+        """Clones or fetches the repo into the cache and returns the clone's path."""
+        path = GitReader._clone_path(repo)
+        if not os.path.isdir(path):
+            GitReader._git("clone", "--bare", "--quiet", repo, path)
+        else:
+            stamp = os.path.join(path, "FETCH_HEAD")
+            if not os.path.exists(stamp) or time.time() - os.path.getmtime(stamp) > GitReader.FETCH_INTERVAL:
+                GitReader._git(
+                    "fetch", "--quiet", "--prune", "origin", "+refs/heads/*:refs/heads/*", cwd=path
+                )
+        return path
+
+    @staticmethod
+    def _matches(path, globs):
+        name = os.path.basename(path)
+        return any(fnmatch.fnmatch(path, g) or fnmatch.fnmatch(name, g) for g in globs)
+
+    @staticmethod
+    def list_files(clone, includes, excludes):
+        """Returns (path, blob id, size) for every file that passes the filters."""
+        files = []
+        for line in GitReader._git("ls-tree", "-r", "-l", "HEAD", cwd=clone).splitlines():
+            info, path = line.split("\t", 1)
+            _, kind, blob, size = info.split()
+            if kind != "blob" or size == "-" or int(size) > GitReader.MAX_FILE_BYTES:
+                continue
+            if includes and not GitReader._matches(path, includes):
+                continue
+            if GitReader._matches(path, GitReader.DEFAULT_EXCLUDES + excludes):
+                continue
+            files.append((path, blob, int(size)))
+        return files
+
+    @staticmethod
+    def _read_blobs(clone, blobs):
+        """Yields (blob, data) using a single git cat-file process."""
+        process = subprocess.Popen(
+            ["git", "cat-file", "--batch"], cwd=clone,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        try:
+            for blob in blobs:
+                process.stdin.write(f"{blob}\n".encode("utf-8"))
+                process.stdin.flush()
+                header = process.stdout.readline().split()
+                if len(header) != 3:
+                    continue
+                data = process.stdout.read(int(header[2]))
+                process.stdout.read(1)
+                yield blob, data
+        finally:
+            process.stdin.close()
+            process.wait()
+
+    @staticmethod
+    def stringify(repo, includes=None, excludes=None, progress=None):
+        """Returns the repo's text files as one Markdown string."""
+        progress = progress or (lambda message: None)
+        progress(f"Fetching {repo}")
+        clone = GitReader.update(repo)
+        files = GitReader.list_files(clone, includes or [], excludes or [])
+        cache = GitReader.get_blob_cache()
+
+        texts = {blob: entry.value for blob, entry in cache.get_many(blob for _, blob, _ in files).items()}
+        missing = [(path, blob) for path, blob, _ in files if blob not in texts]
+        progress(f"{len(files) - len(missing)} of {len(files)} files unchanged")
+
+        blob_paths = {blob: path for path, blob in missing}
+        for number, (blob, data) in enumerate(GitReader._read_blobs(clone, list(blob_paths)), 1):
+            # Binary files are cached as empty text so they are skipped next time too
+            if FileReader.is_binary(data[:FileReader.SNIFF_BYTES]):
+                text = ""
+            else:
+                text = data.decode("utf-8", errors="replace")
+            cache.put(blob, text)
+            texts[blob] = text
+            progress(f"Read {blob_paths[blob]} ({number}/{len(blob_paths)})")
+
+        sections = []
+        total = 0
+        for path, blob, _ in files:
+            text = texts.get(blob)
+            if not text:
+                continue
+            if total + len(text) > GitReader.MAX_TOTAL_BYTES:
+                sections.append(f"[Stopped at {path}: the repository is larger than {GitReader.MAX_TOTAL_BYTES} bytes]")
+                break
+            total += len(text)
+            sections.append(f"### {path}\n\n```\n{text}\n```")
+
+        tree = "\n".join(path for path, _, _ in files)
+        return f"## Files\n\n```\n{tree}\n```\n\n" + "\n\n".join(sections)
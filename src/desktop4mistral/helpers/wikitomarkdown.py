@@ -1,13 +1,28 @@
-import wikipedia
-from markdownify import markdownify
-import requests
+from ..transport import Transport
+from ..cache import FetchCache
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 class WikiHelper:
+    # How long cached pages and searches are served without refetching, in seconds
+    PAGE_MAX_AGE = 7 * 24 * 60 * 60
+    SEARCH_MAX_AGE = 24 * 60 * 60
+
     @staticmethod
     def convert_to_md(pageid):
+        key = f"wiki:{pageid}"
+        cached = FetchCache.get(key, WikiHelper.PAGE_MAX_AGE)
+        if cached:
+            return True, cached.value
+        if FetchCache.get_offline():
+            return False, "Page not cached"
+        import wikipedia
+        from markdownify import markdownify
         try:
             page = wikipedia.page(pageid=pageid)
-            print(page)
+            logger.debug("Fetched %s", page)
             markdown_content = markdownify(
                 page.content,
                 heading_style="ATX",
@@ -15,7 +30,8 @@ class WikiHelper:
                 strip=['sup', 'script']
             )
             
-            markdown_content = '\n\n'.join(line.strip() for line in markdown_content.splitlines() if line.strip())    
+            markdown_content = '\n\n'.join(line.strip() for line in markdown_content.splitlines() if line.strip())
+            FetchCache.put(key, markdown_content)
             return True, markdown_content
             
         except wikipedia.exceptions.DisambiguationError as e:
@@ -25,6 +41,12 @@ class WikiHelper:
         
     @staticmethod
     def search(query):
+        key = f"wiki_search:{query}"
+        cached = FetchCache.get(key, WikiHelper.SEARCH_MAX_AGE)
+        if cached:
+            return json.loads(cached.value)
+        if FetchCache.get_offline():
+            return []
         url = "https://en.wikipedia.org/w/api.php"
         params = {
             "action": "query",
@@ -32,10 +54,11 @@ class WikiHelper:
             "list": "search",
             "srsearch": query
         }
-        response = requests.get(url, params=params)
+        response = Transport.get(url, params=params)
         data = response.json()
         search_results = data["query"]["search"]
         search_results = [{'title': result['title'], 'pageid': result['pageid']} for result in search_results]
+        FetchCache.put(key, json.dumps(search_results))
         return search_results
         
     
@@ -1,11 +1,123 @@
 import sys
-from PySide6.QtWidgets import QApplication
-from .chat_window import ChatWindow
 import os
+import time
+import argparse
+import importlib
+import logging
+
+# Imported one by one under --profile-startup, heaviest dependencies first
+STARTUP_MODULES = [
+    "PySide6.QtWidgets",
+    "PySide6.QtWebEngineWidgets",
+    "requests",
+    "markdown",
+    "desktop4mistral.mistral.client",
+    "desktop4mistral.chat_window",
+]
+
+def profile_imports():
+    timings = []
+    for name in STARTUP_MODULES:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        timings.append((name, time.perf_counter() - start))
+    return timings
+
+def report_startup(timings, started_at):
+    print("Startup profile:")
+    for name, seconds in timings:
+        print(f"  import {name}: {seconds * 1000:.1f} ms")
+    print(f"  time to window: {(time.perf_counter() - started_at) * 1000:.1f} ms")
+
+def env_number(name, kind=float):
+    value = os.environ.get(name)
+    return kind(value) if value else None
+
+def configure_transport(args):
+    from .transport import Transport
+    Transport.configure(
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        max_retries=args.max_retries,
+    )
+
+def configure_context(args):
+    from .mistral.context import ContextManager
+    ContextManager.configure(budget_ratio=args.context_ratio, max_budget=args.context_budget)
+
+def run_batch(args):
+    logging.basicConfig(
+        level=args.log_level,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    if not os.environ.get("MISTRAL_API_KEY"):
+        print("Set MISTRAL_API_KEY to use --batch.")
+        return 1
+    configure_transport(args)
+    configure_context(args)
+    from .batch import BatchRunner
+    if args.cache_responses:
+        from .cache import ResponseCache
+        ResponseCache.set_mode(args.cache_responses)
+    runner = BatchRunner(args.batch, args.output, args.workers, args.per_minute, args.model, args.temperature)
+    return 1 if runner.run() else 0
 
 def main():
+    parser = argparse.ArgumentParser(prog="desktop4mistral")
+    parser.add_argument(
+        "--profile-startup", action="store_true",
+        help="print import times per module and the time until the window is shown"
+    )
+    parser.add_argument(
+        "--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="how much to write to error_log.txt; DEBUG includes every timing"
+    )
+    network = parser.add_argument_group("network")
+    network.add_argument(
+        "--connect-timeout", type=float, default=env_number("MISTRAL_CONNECT_TIMEOUT"),
+        help="seconds to wait for a connection (default: 5, or MISTRAL_CONNECT_TIMEOUT)"
+    )
+    network.add_argument(
+        "--read-timeout", type=float, default=env_number("MISTRAL_READ_TIMEOUT"),
+        help="seconds to wait for data (default: 120, or MISTRAL_READ_TIMEOUT)"
+    )
+    network.add_argument(
+        "--max-retries", type=int, default=env_number("MISTRAL_MAX_RETRIES", int),
+        help="retries for failed or rate-limited requests (default: 4, or MISTRAL_MAX_RETRIES)"
+    )
+    context = parser.add_argument_group("context")
+    context.add_argument(
+        "--context-budget", type=int, default=env_number("MISTRAL_CONTEXT_BUDGET", int),
+        help="most tokens of conversation to send (default: no cap, or MISTRAL_CONTEXT_BUDGET)"
+    )
+    context.add_argument(
+        "--context-ratio", type=float, default=env_number("MISTRAL_CONTEXT_RATIO"),
+        help="share of the model's context length to fill (default: 0.75, or MISTRAL_CONTEXT_RATIO)"
+    )
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument("--batch", metavar="PROMPTS", help="run the conversations in a JSONL file without the window")
+    batch.add_argument("--output", help="where to append results (default: PROMPTS.results.jsonl)")
+    batch.add_argument("--workers", type=int, help="conversations to run at once (default: 4)")
+    batch.add_argument("--per-minute", type=float, help="at most this many API requests per minute")
+    batch.add_argument("--model", help="model for conversations that don't name one")
+    batch.add_argument("--temperature", type=float, help="temperature for conversations that don't set one")
+    batch.add_argument(
+        "--cache-responses", choices=["on", "force"],
+        help="reuse earlier replies to identical requests; 'on' only at temperature 0 and without tools"
+    )
+    args, qt_args = parser.parse_known_args()
+    if args.context_ratio is not None and not 0 < args.context_ratio <= 1:
+        parser.error("--context-ratio must be above 0 and at most 1")
+
+    if args.batch:
+        sys.exit(run_batch(args))
+
     k = None
     sys.stderr = open("error_log.txt", "w")
+    logging.basicConfig(
+        level=args.log_level,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
     if not os.environ.get("MISTRAL_API_KEY"):
         k = input("Please enter your Mistral API key: ")
         if not k:
@@ -14,13 +126,23 @@ def main():
         os.environ["MISTRAL_API_KEY"] = k
 
     try:
-        app = QApplication(sys.argv)
+        started_at = time.perf_counter()
+        timings = profile_imports() if args.profile_startup else []
+        from PySide6.QtWidgets import QApplication
+        from PySide6.QtCore import QTimer
+        from .chat_window import ChatWindow
+        configure_transport(args)
+        configure_context(args)
+
+        app = QApplication([sys.argv[0]] + qt_args)
         window = ChatWindow()
         window.show()
+        if args.profile_startup:
+            QTimer.singleShot(0, lambda: report_startup(timings, started_at))
         sys.exit(app.exec())
     except Exception as e:
+        logging.getLogger(__name__).exception("Desktop4Mistral stopped")
         print(e)
-        pass
     finally:
         sys.stderr.close()
 
@@ -1,9 +1,56 @@
+import hashlib
+import threading
+from collections import OrderedDict
 import markdown
+from pygments.formatters import HtmlFormatter
+from .metrics import Metrics
 
 
 class MarkdownConverter:
+    """
+    Converts Markdown to HTML, highlighting code with Pygments. Safe to
+    use from worker threads: each thread gets its own parser, and results
+    are shared through an LRU cache keyed by the content's hash.
+    """
+    CACHE_SIZE = 512
+    STYLE = "monokai"
+
     def __init__(self):
-        self.markdown = markdown.Markdown(extensions=["tables", "fenced_code"])
+        self.local = threading.local()
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get_markdown(self):
+        if not hasattr(self.local, "markdown"):
+            self.local.markdown = markdown.Markdown(
+                extensions=["tables", "fenced_code", "codehilite"],
+                extension_configs={
+                    "codehilite": {"guess_lang": False, "css_class": "highlight"}
+                },
+            )
+        return self.local.markdown
+
+    @staticmethod
+    def get_css():
+        return HtmlFormatter(style=MarkdownConverter.STYLE).get_style_defs(".highlight")
+
+    def convert(self, text, cache=True):
+        """Returns text as HTML. Pass cache=False for text that won't be seen again."""
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        with Metrics.span("markdown", cached=cache):
+            md = self._get_markdown()
+            html = md.convert(text)
+            md.reset()
+        if not cache:
+            return html
 
-    def convert(self, text):
-        return self.markdown.convert(text)
+        with self.lock:
+            self.cache[key] = html
+            if len(self.cache) > self.CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return html
@@ -0,0 +1,121 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """
+    Timings of everything a message goes through, from command dispatch
+    and HTTP round trips to tools, Markdown, page rendering and speech.
+    The last WINDOW durations of each span are kept for percentiles,
+    counters add up things like tokens, and every span can also be
+    appended to a JSONL file.
+    """
+    WINDOW = 500
+    PERCENTILES = (50, 90, 99)
+
+    _lock = threading.Lock()
+    _samples = {}
+    _counters = {}
+    _export = None
+
+    @staticmethod
+    @contextmanager
+    def span(name, **attributes):
+        """
+        Static method to time a block. The yielded dict can be filled
+        with attributes while the block runs.
+        """
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            Metrics.record(name, (time.perf_counter() - start) * 1000, attributes, started)
+
+    @staticmethod
+    def record(name, milliseconds, attributes=None, started=None):
+        """
+        Static method to add a duration, in milliseconds, measured elsewhere.
+        """
+        logger.debug("%s took %.1f ms %s", name, milliseconds, attributes or "")
+        with Metrics._lock:
+            samples = Metrics._samples.get(name)
+            if samples is None:
+                samples = Metrics._samples[name] = deque(maxlen=Metrics.WINDOW)
+            samples.append(milliseconds)
+            if Metrics._export:
+                started = started if started is not None else time.time() - milliseconds / 1000
+                try:
+                    Metrics._export.write(json.dumps({
+                        "name": name,
+                        "start_time": started,
+                        "duration_ms": round(milliseconds, 3),
+                        "attributes": attributes or {},
+                    }, default=str) + "\n")
+                    Metrics._export.flush()
+                except (OSError, ValueError) as e:
+                    # Timing must never break what is being timed, so stop exporting instead
+                    logger.warning("Stopped exporting timings to %s: %s", Metrics._export.name, e)
+                    Metrics._close_export()
+
+    @staticmethod
+    def add(name, amount=1):
+        """
+        Static method to add to a counter.
+        """
+        with Metrics._lock:
+            Metrics._counters[name] = Metrics._counters.get(name, 0) + amount
+
+    @staticmethod
+    def summary():
+        """
+        Static method to get (name, count, p50, p90, p99) for every span,
+        and the counters.
+        """
+        with Metrics._lock:
+            samples = {name: sorted(values) for name, values in Metrics._samples.items()}
+            counters = dict(Metrics._counters)
+        spans = []
+        for name in sorted(samples):
+            values = samples[name]
+            spans.append((name, len(values)) + tuple(
+                values[min(len(values) - 1, len(values) * p // 100)] for p in Metrics.PERCENTILES
+            ))
+        return spans, counters
+
+    @staticmethod
+    def export_to(path):
+        """
+        Static method to start appending spans to a JSONL file, or to stop
+        with None.
+        """
+        # Opened first, so a bad path leaves the current export as it was
+        export = open(path, "a", encoding="utf-8") if path else None
+        with Metrics._lock:
+            Metrics._close_export()
+            Metrics._export = export
+
+    @staticmethod
+    def _close_export():
+        export, Metrics._export = Metrics._export, None
+        if export:
+            try:
+                export.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def get_export():
+        return Metrics._export.name if Metrics._export else None
+
+    @staticmethod
+    def reset():
+        with Metrics._lock:
+            Metrics._samples = {}
+            Metrics._counters = {}
@@ -1,63 +1,147 @@
-import requests
 import os
 from ..commands import Commands
+from ..transport import Transport
+from ..metrics import Metrics
+from ..cache import ResponseCache
+from ..blobs import BlobStore
+from ..utils import Utils
+from .context import ContextManager
+from .ratelimit import RateLimiter
+from .executor import PythonExecutor
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import RequestException
 import time
 import json
-import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
 
 class Client:
+    # Override with MISTRAL_BASE_URL, e.g. to use the local fake server
+    BASE_URL = "https://api.mistral.ai/v1/"
+    # How long the cached model catalogue is considered fresh, in seconds
+    MODELS_CACHE_TTL = 24 * 60 * 60
+    # Upper bound on model round trips for a single user message
+    MAX_TOOL_ITERATIONS = 8
+    TOOL_WORKERS = 4
+    TOO_MANY_STEPS = "I stopped because this was taking too many steps."
+
     def __init__(self):
-        self.base_url = "https://api.mistral.ai/v1/"
+        self.base_url = os.environ.get("MISTRAL_BASE_URL", self.BASE_URL).rstrip("/") + "/"
         self.api_key = os.environ["MISTRAL_API_KEY"]
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
         self.model_data = None
+        self.model_index = {}
         self.model_id = None
+        self.models_fetched_at = 0
+        self.context = ContextManager()
+        self.rate_limiter = RateLimiter()
+        self.last_steps = []
+        self.document_index = None
+        # None leaves the temperature to the model's default
+        self.temperature = None
+        self.python = PythonExecutor()
+        self.python.warm_up_in_background()
+
+    def _getModelsCacheFile(self):
+        return os.path.join(Utils.get_cache_path(), "models.json")
+
+    def _loadModelsCache(self):
+        try:
+            with open(self._getModelsCacheFile(), "r") as f:
+                cache = json.load(f)
+            return cache["fetched_at"], cache["data"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _saveModelsCache(self):
+        cache = {"fetched_at": self.models_fetched_at, "data": self.model_data}
+        cache_file = self._getModelsCacheFile()
+        temp_file = cache_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(temp_file, cache_file)
+
+    def _setModelData(self, model_data, fetched_at):
+        self.model_data = model_data
+        self.model_index = {model["id"]: model for model in model_data}
+        self.models_fetched_at = fetched_at
 
     def _getModels(self):
         if self.model_data is not None:
             return self.model_data
 
+        cache = self._loadModelsCache()
+        if cache is not None:
+            fetched_at, model_data = cache
+            self._setModelData(model_data, fetched_at)
+            return self.model_data
+
+        try:
+            return self.refreshModels()
+        except RequestException as e:
+            if e.response is not None and e.response.status_code == 401:
+                import sys
+                print("Couldn't access Mistral API. Please check your API key.")
+                sys.exit(1)
+            logger.warning("Couldn't fetch models: %s", e)
+            self._setModelData([], 0)
+            return self.model_data
+
+    def refreshModels(self):
+        """Fetches the model catalogue from the API and updates the cache."""
         url = self.base_url + "models"
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 401:
-            import sys
-            print("Couldn't access Mistral API. Please check your API key.")
-            sys.exit(1)
-        self.model_data = response.json()["data"]
+        response = Transport.get(url, headers=self.headers)
+        response.raise_for_status()
+        self._setModelData(response.json()["data"], time.time())
+        try:
+            self._saveModelsCache()
+        except OSError as e:
+            logger.warning("Couldn't save models cache: %s", e)
         return self.model_data
 
+    def isModelsCacheStale(self):
+        return time.time() - self.models_fetched_at > self.MODELS_CACHE_TTL
+
+    def getModel(self, model_id):
+        return self.model_index.get(model_id)
+
     def setModel(self, model_id):
         self.model_id = model_id
 
+    def setDocumentIndex(self, document_index):
+        self.document_index = document_index
+
     def listModels(self):
         models = self._getModels()
         outputs = []
         for model in models:
             if model["capabilities"]["completion_chat"] and model["id"]:
                 outputs.append(model["id"])
-                print(f"Added {model['id']}")
         return outputs
 
-    def execute_python_code(self, code):
-        with open("temp.py", "w") as f:
-            f.write(code)
-        process = subprocess.Popen(["python", "temp.py"], stdout=subprocess.PIPE)
-        output, _ = process.communicate()
-        if not output:
+    def execute_python_code(self, code, cancel_token=None):
+        stdout, stderr = self.python.run(code, cancel_token=cancel_token)
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        output = stdout
+        if stderr:
+            output += f"\nErrors:\n{stderr}"
+        if not output.strip():
             return "Done."
-        return output.decode("utf-8")
+        return output
 
-    def _handle_tool_call(self, tool_call, messages):
-        """Handles a single tool call and updates the messages."""
+    def _run_tool(self, tool_call, cancel_token=None):
+        """Runs a single tool call and returns its tool message."""
         function_name = tool_call["function"]["name"]
         arguments = json.loads(tool_call["function"]["arguments"])
         tool_call_id = tool_call["id"]
 
         if function_name == "execute_python_code":
-            result = self.execute_python_code(arguments["code"])
+            result = self.execute_python_code(arguments["code"], cancel_token)
         elif function_name == "read_local_file":
             try:
                 with open(arguments["file"], "r") as f:
@@ -80,31 +164,184 @@ class Client:
         else:
             result = f"Unknown tool function: {function_name}"
 
-        time.sleep(3)  # Add a delay after tool execution
-        tool_message = {
+        return {
             "role": "tool",
             "name": function_name,
             "content": result,
             "tool_call_id": tool_call_id,
         }
-        messages.append(tool_message)
-        return result
 
-    def sendChatMessage(self, messages):
-        print(messages)
+    def _timed_tool(self, tool_call, cancel_token=None):
+        start = time.perf_counter()
+        tool_message = self._run_tool(tool_call, cancel_token)
+        seconds = time.perf_counter() - start
+        Metrics.record(f"tool.{tool_message['name']}", seconds * 1000)
+        return tool_message, seconds
+
+    def _handle_tool_calls(self, tool_calls, messages, step, cancel_token=None):
+        """Runs the tool calls in parallel and appends their results in order."""
+        with ThreadPoolExecutor(max_workers=self.TOOL_WORKERS) as executor:
+            results = list(executor.map(
+                lambda tool_call: self._timed_tool(tool_call, cancel_token), tool_calls
+            ))
+        for tool_message, seconds in results:
+            messages.append(tool_message)
+            step["tools"].append({"name": tool_message["name"], "seconds": seconds})
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+
+    def _postChat(self, config, stream=False, cancel_token=None):
+        self.rate_limiter.wait(cancel_token)
         url = self.base_url + "chat/completions"
+        with Transport.cancellable(cancel_token):
+            response = Transport.post(url, headers=self.headers, json=config, stream=stream)
+        self.rate_limiter.update(response.headers)
+        if not response.ok:
+            # Retries are spent by now, so this is the final answer
+            response.close()
+            response.raise_for_status()
+        return response
+
+    def _chatConfig(self, messages):
+        model = self.getModel(self.model_id) or {}
+        fitted = BlobStore.materialize(self.context.fit(messages, model.get("max_context_length")))
+        if self.document_index:
+            fitted = self.document_index.augment(fitted)
+        logger.info("Sending %d of %d messages, ~%d tokens", len(fitted), len(messages), self.context.last_tokens_sent)
         config = {
             "model": self.model_id,
-            "messages": messages,
+            "messages": fitted,
             "tools": Commands.get_tools(),
-            "parallel_tool_calls": False
+            "parallel_tool_calls": True
         }
-        response = requests.post(url, headers=self.headers, json=config).json()
-        print(response)
+        if self.temperature is not None:
+            config["temperature"] = self.temperature
+        return config
 
-        if response["choices"][0]["message"]["tool_calls"]:
-            tool_call = response["choices"][0]["message"]["tool_calls"][0]
-            messages.append(response["choices"][0]["message"])
-            return self._handle_tool_call(tool_call, messages)
-        else:
-            return response["choices"][0]["message"]["content"]
+    def _cacheKey(self, config, tools_called):
+        """Returns the response cache key for config, or None to bypass the cache."""
+        temperature = config.get("temperature")
+        if temperature is None:
+            temperature = (self.getModel(self.model_id) or {}).get("default_model_temperature")
+        return ResponseCache.key(config, temperature, tools_called)
+
+    def _newStep(self):
+        step = {"step": len(self.last_steps) + 1, "request": 0.0, "tools": []}
+        self.last_steps.append(step)
+        return step
+
+    def _logSteps(self):
+        for step in self.last_steps:
+            tools = ", ".join(f"{t['name']} {t['seconds']:.2f}s" for t in step["tools"])
+            logger.info("Step %d: request %.2fs%s", step["step"], step["request"], f", tools: {tools}" if tools else "")
+
+    def _recordUsage(self, usage, seconds):
+        """Counts the tokens the API reports, next to our own estimate."""
+        if not usage:
+            return
+        Metrics.add("tokens.prompt", usage.get("prompt_tokens", 0))
+        Metrics.add("tokens.completion", usage.get("completion_tokens", 0))
+        Metrics.add("chat.generation_ms", seconds * 1000)
+        logger.debug(
+            "Usage: %s prompt tokens (estimated %d), %s completion tokens",
+            usage.get("prompt_tokens"), self.context.last_tokens_sent, usage.get("completion_tokens")
+        )
+
+    def sendChatMessage(self, messages, stream=False, cancel_token=None):
+        """Sends the conversation to the model.
+
+        Tool calls are run and their results fed back to the model until
+        it gives a final answer, for at most MAX_TOOL_ITERATIONS rounds.
+        With stream=True, returns a generator that yields content deltas
+        as they arrive over server-sent events. Cancelling cancel_token
+        closes the stream and raises Cancelled.
+        """
+        if stream:
+            return self._streamChatMessage(messages, cancel_token)
+
+        self.last_steps = []
+        try:
+            for _ in range(self.MAX_TOOL_ITERATIONS):
+                step = self._newStep()
+                start = time.perf_counter()
+                config = self._chatConfig(messages)
+                cache_key = self._cacheKey(config, step["step"] > 1)
+                cached = ResponseCache.get(cache_key) if cache_key else None
+                if cached is not None:
+                    return cached
+                response = self._postChat(config, cancel_token=cancel_token).json()
+                step["request"] = time.perf_counter() - start
+                Metrics.record("chat.request", step["request"] * 1000, {"model": self.model_id})
+                self._recordUsage(response.get("usage"), step["request"])
+
+                message = response["choices"][0]["message"]
+                if not message.get("tool_calls"):
+                    if cache_key:
+                        ResponseCache.put(cache_key, message["content"])
+                    return message["content"]
+                messages.append(message)
+                self._handle_tool_calls(message["tool_calls"], messages, step, cancel_token)
+            return self.TOO_MANY_STEPS
+        finally:
+            self._logSteps()
+
+    def _streamChatMessage(self, messages, cancel_token=None):
+        self.last_steps = []
+        try:
+            for _ in range(self.MAX_TOOL_ITERATIONS):
+                step = self._newStep()
+                start = time.perf_counter()
+                config = self._chatConfig(messages)
+                config["stream"] = True
+                cache_key = self._cacheKey(config, step["step"] > 1)
+                cached = ResponseCache.get(cache_key) if cache_key else None
+                if cached is not None:
+                    yield cached
+                    return
+                content = ""
+                tool_calls = []
+                usage = None
+                with self._postChat(config, stream=True, cancel_token=cancel_token) as response:
+                    if cancel_token:
+                        cancel_token.on_cancel(response.close)
+                    try:
+                        # Split as bytes and decode each line: SSE is always UTF-8, whatever
+                        # the headers say, and str.splitlines would also split on U+2028
+                        for raw_line in response.iter_lines():
+                            line = raw_line.decode("utf-8")
+                            if not line or not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            chunk = json.loads(data)
+                            usage = chunk.get("usage") or usage
+                            if not chunk.get("choices"):
+                                continue
+                            delta = chunk["choices"][0]["delta"]
+                            if delta.get("tool_calls"):
+                                tool_calls.extend(delta["tool_calls"])
+                            if delta.get("content"):
+                                if not content:
+                                    Metrics.record("chat.first_token", (time.perf_counter() - start) * 1000)
+                                content += delta["content"]
+                                yield delta["content"]
+                    except Exception:
+                        if cancel_token:
+                            cancel_token.raise_if_cancelled()
+                        raise
+                step["request"] = time.perf_counter() - start
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                Metrics.record("chat.request", step["request"] * 1000, {"model": self.model_id, "stream": True})
+                self._recordUsage(usage, step["request"])
+
+                if not tool_calls:
+                    if cache_key:
+                        ResponseCache.put(cache_key, content)
+                    return
+                messages.append({"role": "assistant", "content": content, "tool_calls": tool_calls})
+                self._handle_tool_calls(tool_calls, messages, step, cancel_token)
+            yield self.TOO_MANY_STEPS
+        finally:
+            self._logSteps()
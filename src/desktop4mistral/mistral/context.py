@@ -0,0 +1,131 @@
+import hashlib
+from collections import OrderedDict
+from ..commands import Commands
+from ..blobs import CompactContent
+
+
+class ContextManager:
+    """
+    Fits the conversation into a token budget below the model's
+    context length before it is sent. The system prompt is always kept.
+    Hidden payloads of older turns are dropped first, then whole turns,
+    oldest first.
+    """
+    CHARS_PER_TOKEN = 4
+    TOKENS_PER_MESSAGE = 4
+    BUDGET_RATIO = 0.75
+    # Upper bound on the budget in tokens, whatever the model allows
+    MAX_BUDGET = None
+    DEFAULT_CONTEXT_LENGTH = 32768
+    OMITTED_NOTE = "[Earlier contents omitted to save space.]"
+    # Token counts remembered, keyed by a digest so contents aren't kept alive
+    TOKEN_CACHE_SIZE = 2048
+
+    def __init__(self, budget_ratio=None, max_budget=None):
+        self.budget_ratio = budget_ratio or self.BUDGET_RATIO
+        self.max_budget = max_budget or self.MAX_BUDGET
+        self.token_cache = OrderedDict()
+        self.last_tokens_sent = 0
+
+    @staticmethod
+    def configure(budget_ratio=None, max_budget=None):
+        """
+        Static method to change the default budget: the share of the
+        model's context length to use, and a cap in tokens.
+        """
+        if budget_ratio is not None:
+            if not 0 < budget_ratio <= 1:
+                raise ValueError("The context budget ratio must be above 0 and at most 1")
+            ContextManager.BUDGET_RATIO = budget_ratio
+        if max_budget is not None:
+            ContextManager.MAX_BUDGET = max_budget
+
+    def get_budget(self, max_context_length):
+        budget = int((max_context_length or self.DEFAULT_CONTEXT_LENGTH) * self.budget_ratio)
+        if self.max_budget:
+            budget = min(budget, self.max_budget)
+        return budget
+
+    def count_tokens(self, message):
+        content = message.get("content") or ""
+        if isinstance(content, CompactContent):
+            # Sized from the reference; the payload isn't read
+            tokens = len(content) // self.CHARS_PER_TOKEN + 1
+        else:
+            key = hashlib.sha1(content.encode("utf-8")).digest()
+            tokens = self.token_cache.get(key)
+            if tokens is None:
+                tokens = len(content) // self.CHARS_PER_TOKEN + 1
+                self.token_cache[key] = tokens
+                if len(self.token_cache) > self.TOKEN_CACHE_SIZE:
+                    self.token_cache.popitem(last=False)
+            else:
+                self.token_cache.move_to_end(key)
+        if message.get("tool_calls"):
+            tokens += sum(
+                len(call["function"]["arguments"]) // self.CHARS_PER_TOKEN
+                for call in message["tool_calls"]
+            )
+        return tokens + self.TOKENS_PER_MESSAGE
+
+    @staticmethod
+    def strip_hidden(message):
+        content = message.get("content") or ""
+        if isinstance(content, CompactContent):
+            return {**message, "content": content.replace_payload(ContextManager.OMITTED_NOTE)}
+        start = content.find(Commands.HIDDEN_IDENTIFIER_START)
+        if start == -1:
+            return message
+        end = content.find(Commands.HIDDEN_IDENTIFIER_END, start)
+        if end == -1:
+            return message
+        content = (
+            content[:start]
+            + ContextManager.OMITTED_NOTE
+            + content[end + len(Commands.HIDDEN_IDENTIFIER_END):]
+        )
+        return {**message, "content": content}
+
+    @staticmethod
+    def split_turns(messages):
+        """Groups messages into turns, each starting at a user message."""
+        turns = []
+        for message in messages:
+            if message["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    def fit(self, messages, max_context_length=None):
+        """Returns a copy of messages that fits the budget."""
+        budget = self.get_budget(max_context_length)
+        pinned = []
+        if messages and messages[0]["role"] == "system":
+            pinned, messages = [messages[0]], messages[1:]
+
+        turns = self.split_turns(messages)
+        costs = [sum(self.count_tokens(m) for m in turn) for turn in turns]
+        total = sum(self.count_tokens(m) for m in pinned) + sum(costs)
+
+        # Drop hidden payloads from every turn but the latest
+        for i in range(len(turns) - 1):
+            if total <= budget:
+                break
+            stripped = [self.strip_hidden(m) for m in turns[i]]
+            cost = sum(self.count_tokens(m) for m in stripped)
+            total -= costs[i] - cost
+            turns[i], costs[i] = stripped, cost
+
+        # Then drop whole turns, oldest first, always keeping the latest
+        first = 0
+        while total > budget and first < len(turns) - 1:
+            total -= costs[first]
+            first += 1
+
+        fitted = pinned + [m for turn in turns[first:] for m in turn]
+        self.last_tokens_sent = total
+        return fitted
+
+    def clear(self):
+        self.token_cache.clear()
+        self.last_tokens_sent = 0
@@ -0,0 +1,192 @@
+import contextlib
+import io
+import multiprocessing
+import signal
+import sys
+import threading
+import traceback
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class _CappedWriter(io.TextIOBase):
+    """A text sink that keeps at most limit characters."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.truncated = False
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        room = self.limit - self.size
+        if room > 0:
+            kept = text[:room]
+            self.parts.append(kept)
+            self.size += len(kept)
+        if len(text) > max(room, 0):
+            self.truncated = True
+        return len(text)
+
+    def getvalue(self):
+        value = "".join(self.parts)
+        if self.truncated:
+            value += "\n[Output truncated]"
+        return value
+
+
+def _worker_main(conn, memory_limit):
+    """Entry point of a worker interpreter. Runs code sent over conn in one namespace."""
+    # Ctrl+C in a terminal reaches the whole process group; the parent decides
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if resource and memory_limit:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ValueError, OSError):
+            pass
+
+    namespace = {"__name__": "__main__"}
+    while True:
+        try:
+            code, cpu_limit, output_limit = conn.recv()
+        except EOFError:
+            return
+
+        if resource and cpu_limit:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            used = int(usage.ru_utime + usage.ru_stime)
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            soft = used + cpu_limit
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            try:
+                resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+            except (ValueError, OSError):
+                pass
+
+        stdout = _CappedWriter(output_limit)
+        stderr = _CappedWriter(output_limit)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                exec(compile(code, "<tool>", "exec"), namespace)
+            except BaseException:
+                error_type, error, tb = sys.exc_info()
+                traceback.print_exception(error_type, error, tb.tb_next)
+        conn.send((stdout.getvalue(), stderr.getvalue()))
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+
+    def close(self):
+        self.kill()
+        self.conn.close()
+
+
+class PythonExecutor:
+    """
+    Runs tool code in pre-started worker interpreters. Each session keeps
+    its own worker, so variables defined in one call are still there in
+    the next. Workers are limited in wall-clock time, CPU time, memory
+    and output size, and are replaced when they die.
+    """
+    POOL_SIZE = 1
+    TIMEOUT = 60
+    CPU_LIMIT = 30
+    MEMORY_LIMIT = 1024 * 1024 * 1024
+    OUTPUT_LIMIT = 64 * 1024
+
+    def __init__(self):
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._idle = []
+        self._sessions = {}
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, args=(child_conn, self.MEMORY_LIMIT), daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def warm_up(self):
+        """Starts idle workers until the pool is full."""
+        while True:
+            with self._lock:
+                self._idle = [w for w in self._idle if w.is_alive()]
+                if len(self._idle) >= self.POOL_SIZE:
+                    return
+            worker = self._start_worker()
+            with self._lock:
+                self._idle.append(worker)
+
+    def warm_up_in_background(self):
+        threading.Thread(target=self.warm_up, daemon=True).start()
+
+    def _acquire(self, session):
+        with self._lock:
+            worker = self._sessions.get(session)
+            if worker and worker.is_alive():
+                return worker
+            worker = self._idle.pop() if self._idle else None
+        if worker is None or not worker.is_alive():
+            worker = self._start_worker()
+        with self._lock:
+            self._sessions[session] = worker
+        self.warm_up_in_background()
+        return worker
+
+    def _discard(self, session, worker):
+        worker.close()
+        with self._lock:
+            if self._sessions.get(session) is worker:
+                del self._sessions[session]
+
+    def run(self, code, session="default", cancel_token=None):
+        """Runs code in the session's worker. Returns (stdout, stderr)."""
+        worker = self._acquire(session)
+        if cancel_token:
+            cancel_token.on_cancel(worker.kill)
+
+        with worker.lock:
+            try:
+                worker.conn.send((code, self.CPU_LIMIT, self.OUTPUT_LIMIT))
+                if not worker.conn.poll(self.TIMEOUT):
+                    self._discard(session, worker)
+                    return "", f"Execution timed out after {self.TIMEOUT} seconds."
+                return worker.conn.recv()
+            except (EOFError, OSError):
+                self._discard(session, worker)
+                return "", "The Python process was stopped. It may have hit a CPU or memory limit."
+
+    def reset_session(self, session="default"):
+        """Forgets the session's variables by discarding its worker."""
+        with self._lock:
+            worker = self._sessions.pop(session, None)
+        if worker:
+            worker.close()
+
+    def shutdown(self):
+        with self._lock:
+            workers = self._idle + list(self._sessions.values())
+            self._idle = []
+            self._sessions = {}
+        for worker in workers:
+            worker.close()
@@ -0,0 +1,195 @@
+"""
+A local stand-in for the Mistral API, for trying the app and timing it
+without a network or an API key. Start it, then point the app at it:
+
+    python -m desktop4mistral.mistral.fakeserver --latency 0.3 --tokens-per-second 40
+    MISTRAL_BASE_URL=http://127.0.0.1:8765/v1/ MISTRAL_API_KEY=fake desktop4mistral
+
+Replies are made up from the user's message. A message starting with
+"!python " makes the model call execute_python_code with the rest of the
+message, so the tool round trip can be exercised too.
+"""
+import argparse
+import itertools
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOOL_PREFIX = "!python "
+WORDS = (
+    "the model is only pretending here so every word of this reply is made up "
+    "on the spot to take about as long as a real answer would"
+).split()
+
+
+class FakeMistral:
+    """The behaviour of the fake API: its models, replies and pacing."""
+    MODELS = ["mistral-large-latest", "mistral-small-latest"]
+
+    def __init__(self, latency=0.2, tokens_per_second=50.0, reply_tokens=120):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+
+    def models(self):
+        return {
+            "object": "list",
+            "data": [
+                {
+                    "id": model,
+                    "object": "model",
+                    "description": f"Fake {model} served locally.",
+                    "capabilities": {"completion_chat": True, "function_calling": True},
+                    "max_context_length": 32768,
+                    "default_model_temperature": 0.7,
+                }
+                for model in self.MODELS
+            ],
+        }
+
+    @staticmethod
+    def count_tokens(messages):
+        return sum(len(str(message.get("content") or "")) // 4 + 1 for message in messages)
+
+    def reply(self, messages):
+        """Returns (tokens, tool_calls) for the next assistant message."""
+        last = messages[-1] if messages else {}
+        content = str(last.get("content") or "")
+        if last.get("role") == "user" and content.startswith(TOOL_PREFIX):
+            return [], [{
+                "id": uuid.uuid4().hex[:9],
+                "type": "function",
+                "function": {
+                    "name": "execute_python_code",
+                    "arguments": json.dumps({"code": content[len(TOOL_PREFIX):]}),
+                },
+            }]
+        if last.get("role") == "tool":
+            return [f"The code printed: {content.strip() or 'nothing'}"], []
+        words = itertools.islice(itertools.cycle(WORDS), self.reply_tokens)
+        return [word + " " for word in words], []
+
+    def usage(self, messages, tokens):
+        prompt = self.count_tokens(messages)
+        return {"prompt_tokens": prompt, "completion_tokens": len(tokens), "total_tokens": prompt + len(tokens)}
+
+
+class FakeMistralHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self.send_json(200, self.api.models())
+        else:
+            self.send_json(404, {"message": "Not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self.send_json(404, {"message": "Not found"})
+            return
+        messages = request.get("messages", [])
+        model = request.get("model") or self.api.MODELS[0]
+        tokens, tool_calls = self.api.reply(messages)
+        time.sleep(self.api.latency)
+        if request.get("stream"):
+            self.stream(model, messages, tokens, tool_calls)
+            return
+
+        time.sleep(len(tokens) / self.api.tokens_per_second)
+        message = {"role": "assistant", "content": "".join(tokens)}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        self.send_json(200, {
+            "id": uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if tool_calls else "stop",
+            }],
+            "usage": self.api.usage(messages, tokens),
+        })
+
+    def stream(self, model, messages, tokens, tool_calls):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        chunk_id = uuid.uuid4().hex
+
+        def send(delta, finish_reason=None, usage=None):
+            chunk = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if usage:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            send({"role": "assistant", "content": ""})
+            for token in tokens:
+                time.sleep(1 / self.api.tokens_per_second)
+                send({"content": token})
+            if tool_calls:
+                send({"tool_calls": [dict(call, index=i) for i, call in enumerate(tool_calls)]})
+            send({}, "tool_calls" if tool_calls else "stop", self.api.usage(messages, tokens))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, as it does when a reply is cancelled
+            pass
+
+
+def serve(host="127.0.0.1", port=8765, latency=0.2, tokens_per_second=50.0, reply_tokens=120):
+    """Returns a server for the fake API; call serve_forever() on it."""
+    handler = type("Handler", (FakeMistralHandler,), {
+        "api": FakeMistral(latency, tokens_per_second, reply_tokens)
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Mistral API locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first byte")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--reply-tokens", type=int, default=120, help="length of made-up replies")
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.latency, args.tokens_per_second, args.reply_tokens)
+    print(f"Fake Mistral API on http://{args.host}:{server.server_port}/v1/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Holds requests back only when the API says the quota is spent, using
+    the Retry-After and rate-limit headers of the previous response. With
+    per_minute set, requests are also spaced out evenly ahead of time.
+    """
+    # Used when a quota is exhausted but no reset time is given, in seconds
+    DEFAULT_RESET = {"second": 1, "minute": 60, "hour": 3600}
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, per_minute=None):
+        self._lock = threading.Lock()
+        self.resume_at = 0.0
+        self.interval = 60 / per_minute if per_minute else 0.0
+        self.next_slot = 0.0
+
+    def update(self, headers):
+        """Reads the rate-limit headers of a response."""
+        delay = 0.0
+        retry_after = headers.get("Retry-After")
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                pass
+
+        reset = None
+        exhausted = []
+        for name, value in headers.items():
+            name = name.lower()
+            if "ratelimit" not in name:
+                continue
+            if "reset" in name:
+                try:
+                    reset = float(value)
+                except ValueError:
+                    pass
+            elif "remaining" in name and value.strip() == "0":
+                exhausted.append(name)
+
+        for name in exhausted:
+            if reset is not None:
+                delay = max(delay, reset)
+            else:
+                for window, seconds in self.DEFAULT_RESET.items():
+                    if name.endswith(window):
+                        delay = max(delay, seconds)
+
+        if delay > 0:
+            with self._lock:
+                self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+    def wait(self, cancel_token=None):
+        """Blocks until requests may be sent again."""
+        slot = 0.0
+        if self.interval:
+            with self._lock:
+                slot = self.next_slot = max(self.next_slot, time.monotonic())
+                self.next_slot += self.interval
+        while True:
+            with self._lock:
+                remaining = max(self.resume_at, slot) - time.monotonic()
+            if remaining <= 0:
+                return
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            time.sleep(min(remaining, self.POLL_INTERVAL))
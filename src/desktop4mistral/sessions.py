@@ -0,0 +1,172 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from .utils import Utils
+
+
+class SessionStore:
+    """
+    Every conversation, saved message by message as it happens, in an
+    append-only SQLite log. Sessions can be listed, searched by title and
+    read back in ranges, so resuming a long one doesn't load all of it.
+    Messages are also added to a full-text index as they are saved, and
+    the indexed documents a session has read are kept with it.
+    """
+    TITLE_LENGTH = 60
+    SNIPPET_TOKENS = 12
+    TOKEN = re.compile(r"\w+")
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(Utils.get_data_path(), "sessions.sqlite")
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY, title TEXT, created REAL, updated REAL,
+                message_count INTEGER DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY, session INTEGER, position INTEGER,
+                role TEXT, content TEXT, model TEXT, created REAL
+            );
+            CREATE TABLE IF NOT EXISTS session_documents (
+                session INTEGER, position INTEGER, document TEXT,
+                PRIMARY KEY (session, position)
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS messages_position ON messages (session, position);
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_text USING fts5(
+                text, tokenize='porter unicode61', prefix='2 3'
+            );
+            """
+        )
+
+    @staticmethod
+    def to_match(query, prefix=False):
+        """Turns free text into an FTS query that matches all of its words."""
+        words = [f'"{word}"' for word in SessionStore.TOKEN.findall(query)]
+        if words and prefix:
+            words[-1] += "*"
+        return " ".join(words)
+
+    def create_session(self):
+        now = time.time()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO sessions (title, created, updated) VALUES (?, ?, ?)",
+                ("New chat", now, now),
+            )
+        return cursor.lastrowid
+
+    def append(self, session_id, role, content, model=None, text=None):
+        """
+        Saves one message at the end of a session and returns its position.
+        text is what gets indexed for search, if not the whole content.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            position = self._connection.execute(
+                "SELECT message_count FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()[0]
+            cursor = self._connection.execute(
+                "INSERT INTO messages (session, position, role, content, model, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, position, role, content, model, now),
+            )
+            self._connection.execute(
+                "INSERT INTO messages_text (rowid, text) VALUES (?, ?)",
+                (cursor.lastrowid, content if text is None else text),
+            )
+            self._connection.execute(
+                "UPDATE sessions SET updated = ?, message_count = message_count + 1 WHERE id = ?",
+                (now, session_id),
+            )
+            if position == 0 and role == "user":
+                title = " ".join(content.split())[:self.TITLE_LENGTH]
+                self._connection.execute(
+                    "UPDATE sessions SET title = ? WHERE id = ?", (title, session_id)
+                )
+        return position
+
+    def list_sessions(self, limit=20, query=None):
+        """Returns (id, title, updated, message_count) for recent sessions."""
+        sql = "SELECT id, title, updated, message_count FROM sessions WHERE message_count > 0"
+        params = []
+        if query:
+            sql += " AND title LIKE ?"
+            params.append(f"%{query}%")
+        sql += " ORDER BY updated DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def search(self, query, limit=20, highlight=("", ""), prefix=False):
+        """
+        Returns the best matching messages, best first, as dicts with the
+        session, position, title, role and a snippet around the match.
+        """
+        match = self.to_match(query, prefix)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                """SELECT messages.session, messages.position, sessions.title, messages.role,
+                snippet(messages_text, 0, ?, ?, '...', ?)
+                FROM messages_text
+                JOIN messages ON messages.id = messages_text.rowid
+                JOIN sessions ON sessions.id = messages.session
+                WHERE messages_text MATCH ? ORDER BY rank LIMIT ?""",
+                (highlight[0], highlight[1], self.SNIPPET_TOKENS, match, limit),
+            ).fetchall()
+        return [
+            {"session": session, "position": position, "title": title, "role": role, "snippet": snippet}
+            for session, position, title, role, snippet in rows
+        ]
+
+    def count(self, session_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT message_count FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def read(self, session_id, start, end):
+        """Returns the messages at positions start to end - 1 as dicts."""
+        with self._lock:
+            rows = self._connection.execute(
+                """SELECT role, content, model FROM messages
+                WHERE session = ? AND position >= ? AND position < ? ORDER BY position""",
+                (session_id, start, end),
+            ).fetchall()
+        return [{"role": role, "content": content, "model": model} for role, content, model in rows]
+
+    def set_documents(self, session_id, documents):
+        """Saves the ids of the indexed documents a session has read, oldest first."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM session_documents WHERE session = ?", (session_id,))
+            self._connection.executemany(
+                "INSERT INTO session_documents (session, position, document) VALUES (?, ?, ?)",
+                [(session_id, position, document) for position, document in enumerate(documents)],
+            )
+
+    def get_documents(self, session_id):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT document FROM session_documents WHERE session = ? ORDER BY position",
+                (session_id,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def delete_session(self, session_id):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM session_documents WHERE session = ?", (session_id,))
+            self._connection.execute(
+                "DELETE FROM messages_text WHERE rowid IN (SELECT id FROM messages WHERE session = ?)",
+                (session_id,),
+            )
+            self._connection.execute("DELETE FROM messages WHERE session = ?", (session_id,))
+            self._connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
@@ -1,29 +1,131 @@
 from .state import State
+from .metrics import Metrics
 from str2speech.speaker import Speaker as S
 import tempfile
 import scipy.io.wavfile as wav
 import sounddevice as sd
 import os
+import queue
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
 
 class Speaker:
+    """
+    Speaks text sentence by sentence. One background thread synthesizes
+    sentences ahead while another plays the finished ones, so speech
+    starts after the first sentence and the caller never waits.
+    """
+    # How many synthesized sentences may wait to be played
+    AHEAD = 3
+    # Frames written to the output stream at a time; bounds stop latency
+    BLOCK_FRAMES = 2048
+    SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+    MIN_SENTENCE = 40
+
     def __init__(self):
         self.speaker = S(tts_model="kokoro")
+        self.sentences = queue.Queue()
+        self.audio = queue.Queue(maxsize=self.AHEAD)
+        self.generation = 0
+        self.requested_at = None
+        self.time_to_first_audio = None
+        threading.Thread(target=self._synthesize_loop, daemon=True).start()
+        threading.Thread(target=self._play_loop, daemon=True).start()
+
+    @staticmethod
+    def split(text):
+        """Splits text into sentences, joining very short ones."""
+        sentences = []
+        for part in Speaker.SENTENCE_END.split(text):
+            part = part.strip()
+            if not part:
+                continue
+            if sentences and len(sentences[-1]) < Speaker.MIN_SENTENCE:
+                sentences[-1] += " " + part
+            else:
+                sentences.append(part)
+        return sentences
 
     def speak(self, text: str):
         if State.get_talk_mode():
-            tfile = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-            print(tfile.name)
-            self.speaker.text_to_speech(text, tfile.name)
-            dir_path = os.path.dirname(os.path.realpath(tfile.name))
-            file_name = os.path.basename(tfile.name)
-            i = 0            
-            while True:                
+            self.requested_at = time.monotonic()
+            self.time_to_first_audio = None
+            for sentence in self.split(text):
+                self.sentences.put((self.generation, sentence))
+
+    def stop(self):
+        """Stops speaking and drops everything that is queued."""
+        self.generation += 1
+        for pending in (self.sentences, self.audio):
+            while True:
+                try:
+                    pending.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _synthesize(self, sentence):
+        """Returns the (sample_rate, data) chunks for a sentence."""
+        chunks = []
+        with tempfile.TemporaryDirectory() as dir_path:
+            file_name = "speech.wav"
+            self.speaker.text_to_speech(sentence, os.path.join(dir_path, file_name))
+            i = 0
+            while True:
                 file_name = f"{i}_" + file_name
                 if not os.path.exists(os.path.join(dir_path, file_name)):
                     break
-                sample_rate, data = wav.read(os.path.join(dir_path, file_name))
-                sd.play(data, sample_rate, blocking=True)
+                chunks.append(wav.read(os.path.join(dir_path, file_name)))
                 i += 1
-                
-            tfile.close()
-        
\ No newline at end of file
+            if not chunks and os.path.exists(os.path.join(dir_path, "speech.wav")):
+                chunks.append(wav.read(os.path.join(dir_path, "speech.wav")))
+        return chunks
+
+    def _synthesize_loop(self):
+        while True:
+            generation, sentence = self.sentences.get()
+            if generation != self.generation:
+                continue
+            try:
+                with Metrics.span("tts.synthesize", characters=len(sentence)):
+                    chunks = self._synthesize(sentence)
+            except Exception:
+                logger.exception("Couldn't synthesize speech")
+                continue
+            for sample_rate, data in chunks:
+                if generation != self.generation:
+                    break
+                self.audio.put((generation, sample_rate, data))
+
+    def _play_loop(self):
+        stream = None
+        while True:
+            generation, sample_rate, data = self.audio.get()
+            if generation != self.generation:
+                continue
+            channels = 1 if data.ndim == 1 else data.shape[1]
+            if (
+                stream is None
+                or stream.samplerate != sample_rate
+                or stream.channels != channels
+                or stream.dtype != data.dtype
+            ):
+                if stream is not None:
+                    stream.close()
+                stream = sd.OutputStream(samplerate=sample_rate, channels=channels, dtype=data.dtype)
+                stream.start()
+
+            if self.time_to_first_audio is None and self.requested_at is not None:
+                self.time_to_first_audio = time.monotonic() - self.requested_at
+                Metrics.record("tts.first_audio", self.time_to_first_audio * 1000)
+
+            data = data.reshape(len(data), channels)
+            for start in range(0, len(data), self.BLOCK_FRAMES):
+                if generation != self.generation:
+                    stream.abort()
+                    stream.start()
+                    break
+                stream.write(data[start:start + self.BLOCK_FRAMES])
@@ -0,0 +1,210 @@
+import requests
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from .metrics import Metrics
+
+# The CancelToken of the requests being sent by each thread, if any
+_local = threading.local()
+
+
+class CancellableConnection:
+    """
+    Lets a request be aborted while it waits for the response headers,
+    which can take as long as a whole generation. Cancelling shuts the
+    socket down, and the request raises Cancelled instead of retrying.
+    """
+    def getresponse(self, *args, **kwargs):
+        cancel_token = getattr(_local, "cancel_token", None)
+        if cancel_token is None:
+            return super().getresponse(*args, **kwargs)
+        cancel_token.raise_if_cancelled()
+        cancel_token.on_cancel(self._abort)
+        try:
+            return super().getresponse(*args, **kwargs)
+        except Exception:
+            cancel_token.raise_if_cancelled()
+            raise
+        finally:
+            # The connection goes back to the pool, where cancelling must not reach it
+            cancel_token.remove_callback(self._abort)
+
+    def _abort(self):
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class TimedHTTPConnection(CancellableConnection, HTTPConnection):
+    def connect(self):
+        with Metrics.span("http.connect", host=self.host):
+            super().connect()
+
+
+class TimedHTTPSConnection(CancellableConnection, HTTPSConnection):
+    def connect(self):
+        with Metrics.span("http.connect", host=self.host):
+            super().connect()
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    """An adapter whose new connections record how long they took to open."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+class RequestRetry(Retry):
+    """
+    Retries idempotent requests on connection errors, read errors and
+    retryable statuses. A POST, such as a chat turn, may already have been
+    processed when its read fails, so it is only retried when the server
+    turned it away.
+    """
+    REFUSED_STATUSES = frozenset((429, 503))
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if not self._is_method_retryable(method):
+            return bool(self.total) and status_code in self.REFUSED_STATUSES
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class Transport:
+    """
+    A single pooled HTTP session shared by the Mistral client, the
+    commands and the helpers, so that connections are kept alive
+    between requests.
+    """
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 120
+    MAX_RETRIES = 4
+    BACKOFF_FACTOR = 0.5
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    POOL_SIZE = 10
+
+    _session = None
+
+    @staticmethod
+    def configure(connect_timeout=None, read_timeout=None, max_retries=None, backoff_factor=None):
+        """
+        Static method to change the timeouts and retry policy. The session
+        is rebuilt on next use.
+        """
+        if connect_timeout is not None:
+            Transport.CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            Transport.READ_TIMEOUT = read_timeout
+        if max_retries is not None:
+            Transport.MAX_RETRIES = max_retries
+        if backoff_factor is not None:
+            Transport.BACKOFF_FACTOR = backoff_factor
+        Transport.close()
+
+    @staticmethod
+    def get_session():
+        """
+        Static method to get the shared session, creating it if needed.
+        """
+        if Transport._session is None:
+            retry = RequestRetry(
+                total=Transport.MAX_RETRIES,
+                backoff_factor=Transport.BACKOFF_FACTOR,
+                status_forcelist=Transport.RETRY_STATUSES,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = TimedAdapter(
+                max_retries=retry,
+                pool_connections=Transport.POOL_SIZE,
+                pool_maxsize=Transport.POOL_SIZE,
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            Transport._session = session
+        return Transport._session
+
+    @staticmethod
+    @contextmanager
+    def cancellable(cancel_token):
+        """
+        Static method to make the requests this thread sends in the block
+        abortable through cancel_token, raising Cancelled when it is.
+        """
+        previous = getattr(_local, "cancel_token", None)
+        _local.cancel_token = cancel_token
+        try:
+            yield
+        finally:
+            _local.cancel_token = previous
+
+    @staticmethod
+    def request(method, url, **kwargs):
+        kwargs.setdefault("timeout", (Transport.CONNECT_TIMEOUT, Transport.READ_TIMEOUT))
+        start = time.perf_counter()
+        response = Transport.get_session().request(method, url, **kwargs)
+        # elapsed stops at the response headers; streamed bodies are timed by the caller
+        Metrics.record("http.ttfb", response.elapsed.total_seconds() * 1000, {"url": url})
+        if not kwargs.get("stream"):
+            Metrics.record("http.total", (time.perf_counter() - start) * 1000, {"url": url})
+        return response
+
+    @staticmethod
+    def get(url, **kwargs):
+        return Transport.request("GET", url, **kwargs)
+
+    @staticmethod
+    def post(url, **kwargs):
+        return Transport.request("POST", url, **kwargs)
+
+    @staticmethod
+    def get_stats():
+        """
+        Static method to get the number of requests sent, connections
+        opened and connections reused across all pools.
+        """
+        requests_sent = 0
+        new_connections = 0
+        if Transport._session is not None:
+            seen = set()
+            for adapter in Transport._session.adapters.values():
+                if id(adapter) in seen:
+                    continue
+                seen.add(id(adapter))
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    requests_sent += pool.num_requests
+                    new_connections += pool.num_connections
+        return {
+            "requests": requests_sent,
+            "new_connections": new_connections,
+            "reused_connections": max(requests_sent - new_connections, 0),
+        }
+
+    @staticmethod
+    def close():
+        """
+        Static method to close the shared session and its pooled connections.
+        """
+        if Transport._session is not None:
+            Transport._session.close()
+            Transport._session = None
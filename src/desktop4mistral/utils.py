@@ -12,14 +12,36 @@ class Utils:
     def get_documents_path():
         return os.path.join(Utils.get_home_path(), "Documents")
 
+    @staticmethod
+    def get_cache_path():
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(Utils.get_home_path(), ".cache")
+        path = os.path.join(base, "desktop4mistral")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def get_data_path():
+        base = os.environ.get("XDG_DATA_HOME") or os.path.join(Utils.get_home_path(), ".local", "share")
+        path = os.path.join(base, "desktop4mistral")
+        os.makedirs(path, exist_ok=True)
+        return path
+
     @staticmethod
     def generate_filename(extension="txt"):
-        current_time = datetime.now()        
+        current_time = datetime.now()
         timestamp = current_time.strftime("%Y%m%d_%H%M%S")
-        return os.path.join(
+        filename = os.path.join(
             Utils.get_documents_path(),
             f"conversation_{timestamp}.{extension}"
         )
+        i = 1
+        while os.path.exists(filename):
+            filename = os.path.join(
+                Utils.get_documents_path(),
+                f"conversation_{timestamp}_{i}.{extension}"
+            )
+            i += 1
+        return filename
 
     @staticmethod
     def to_json(messages):